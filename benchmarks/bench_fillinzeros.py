@@ -0,0 +1,52 @@
+"""Benchmark fillinzeros: compiled kernel vs pure-Python fallback.
+
+Run from the repository root:
+    python benchmarks/bench_fillinzeros.py [--resolutions 0.5 0.25 0.1]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+from synthetic import ct, region_mask as make_mask
+
+
+def best_of(func, mask, repeat):
+    times = []
+    for _ in range(repeat):
+        m = mask.copy()
+        t0 = time.perf_counter()
+        out = func(m)
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--resolutions', type=float, nargs='+',
+                        default=[0.5, 0.25, 0.1])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if ct.fillinzeros_kernel() is None:
+        print('numba not installed: only the pure-Python path is timed')
+    else:
+        ct.fillinzeros(make_mask(10.), use_jit=True)  # compile outside timing
+
+    print(f"{'res':>6} {'shape':>12} {'python (s)':>11} {'jit (s)':>9} {'speedup':>8} identical")
+    for res in args.resolutions:
+        mask = make_mask(res)
+        tpy, outpy = best_of(lambda m: ct.fillinzeros(m, use_jit=False), mask, 1)
+        if ct.fillinzeros_kernel() is None:
+            print(f'{res:>6} {str(mask.shape):>12} {tpy:11.3f}')
+            continue
+        tjit, outjit = best_of(lambda m: ct.fillinzeros(m, use_jit=True), mask, args.repeat)
+        print(f'{res:>6} {str(mask.shape):>12} {tpy:11.3f} {tjit:9.4f} '
+              f'{tpy/tjit:7.0f}x {np.array_equal(outpy, outjit)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark add_gridded drawing modes: pcolor vs quad mesh vs raster.
+
+Each mode draws the same global field on make_map_base and saves a PNG;
+wall time and the fraction of pixels that differ from the pcolor output
+are reported (and with --memory the peak Python memory, traced in a
+separate run since tracing slows pcolor down several times). pcolor takes
+minutes at 0.5 degrees, so it can be skipped with --modes. Run from the repository root:
+    python benchmarks/bench_gridded.py [--resolutions 2 1 0.5] [--modes mesh raster] [--memory]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from plottools import maps
+
+
+def make_field(res):
+    """Smooth global field on cell centres of res degrees, with a NaN patch."""
+    lons = np.arange(-180 + res/2, 180, res)
+    lats = np.arange(-90 + res/2, 90, res)
+    field = np.cos(np.deg2rad(lats))[:, None]*np.sin(np.deg2rad(2*lons))[None, :]
+    field[:len(lats)//6, :len(lons)//5] = np.nan
+    return lons, lats, field
+
+
+def draw(mode, lons, lats, field, fname):
+    t0 = time.perf_counter()
+    ax = maps.make_map_base()
+    maps.add_gridded(ax, lons, lats, field, mode=mode, vmin=-1, vmax=1)
+    plt.savefig(fname, dpi=100)
+    plt.close('all')
+    return time.perf_counter() - t0
+
+
+def peak_memory(mode, lons, lats, field, fname):
+    maps._raster_indices.clear()
+    tracemalloc.start()
+    draw(mode, lons, lats, field, fname)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return f'{peak/2**20:.1f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--resolutions', type=float, nargs='+', default=[2., 1.])
+    parser.add_argument('--modes', nargs='+', default=['pcolor', 'mesh', 'raster'])
+    parser.add_argument('--memory', action='store_true', help='also trace peak memory')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    print(f"{'res':>5} {'mode':>7} {'time (s)':>9} {'peak (MB)':>10} {'% px != pcolor':>15}")
+    for res in args.resolutions:
+        lons, lats, field = make_field(res)
+        images = {}
+        for mode in args.modes:
+            fname = os.path.join(tmp, f'{mode}_{res}.png')
+            t = draw(mode, lons, lats, field, fname)
+            images[mode] = plt.imread(fname)
+            peak = peak_memory(mode, lons, lats, field, fname) if args.memory else '-'
+            diff = '-'
+            if 'pcolor' in images and mode != 'pcolor':
+                differs = np.abs(images[mode] - images['pcolor']).max(axis=-1) > 0.1
+                diff = f'{100*differs.mean():.2f}'
+            print(f'{res:>5} {mode:>7} {t:9.3f} {peak:>10} {diff:>15}')
+        if 'raster' in args.modes:  # second draw reuses the cached reprojection index
+            t = draw('raster', lons, lats, field, os.path.join(tmp, 'again.png'))
+            print(f"{res:>5} {'(cached)':>7} {t:9.3f}")
+    print(f'images in {tmp}')
+
+
+if __name__ == '__main__':
+    main()
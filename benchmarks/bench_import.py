@@ -0,0 +1,65 @@
+"""Benchmark the start-up cost of importing catchtools.
+
+Each case runs in a fresh interpreter; the median wall time is reported
+along with the heavy modules it loaded. Run from the repository root:
+    python benchmarks/bench_import.py [--repeat 7] [--rev baseline-commit]
+
+--rev also times catchtools.py as it was at a git revision (e.g. before
+plotting imports were made lazy).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+HEAVY = ['pandas', 'scipy', 'matplotlib', 'pylab', 'shapefile', 'numba', 'cartopy']
+
+PROBE = """
+import json, sys, time
+sys.path.insert(0, {path!r})
+t0 = time.perf_counter()
+{statement}
+t = time.perf_counter() - t0
+print(json.dumps({{'time': t, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(statement, path, repeat):
+    code = PROBE.format(path=path, statement=statement, heavy=HEAVY)
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                             text=True, check=True, env=dict(os.environ, MPLBACKEND='Agg'))
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    times = sorted(r['time'] for r in runs)
+    return times[len(times)//2], runs[-1]['loaded']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--rev', default=None,
+                        help='git revision of catchtools.py to compare against')
+    args = parser.parse_args()
+
+    cases = [('import catchtools', 'import catchtools', ROOT),
+             ('+ first plotting use', 'import catchtools; catchtools.plt', ROOT)]
+    if args.rev is not None:
+        tmp = tempfile.mkdtemp()
+        source = subprocess.run(['git', 'show', f'{args.rev}:catchtools.py'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        with open(os.path.join(tmp, 'catchtools.py'), 'w') as f:
+            f.write(source)
+        cases.append((f'import catchtools @ {args.rev}', 'import catchtools', tmp))
+
+    print(f"{'case':<32} {'median (s)':>10}  heavy modules loaded")
+    for label, statement, path in cases:
+        t, loaded = time_import(statement, path, args.repeat)
+        print(f"{label:<32} {t:10.3f}  {', '.join(loaded) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Check that SparseGrid operations stay sparse in memory.
+
+A (category, region, lat, lon) SparseGrid is combined with a per-category
+Hg map of shape (category, 1, lat, lon), which broadcasts over regions.
+Each operation's peak Python memory must stay within --limit times the
+stored grid (data, indices and indptr), i.e. of the order of nnz rather than
+of the dense cube; the script exits with an error otherwise. Run from the
+repository root:
+    python benchmarks/bench_sparse.py [--regions 50] [--nnz 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy.sparse as sps
+
+sys.path.insert(0, os.path.dirname(__file__))
+from synthetic import ct, CELLX, CELLY
+
+
+def sparse_cube(ncat, nreg, nnz, seed=0):
+    rng = np.random.default_rng(seed)
+    ncells = CELLX*CELLY
+    flat = rng.choice(ncat*nreg*ncells, size=nnz, replace=False)
+    rows, cells = np.divmod(flat, ncells)
+    matrix = sps.csr_matrix((rng.lognormal(0, 2, nnz), (rows, cells)),
+                            shape=(ncat*nreg, ncells))
+    return ct.SparseGrid(matrix, (ncat, nreg, CELLY, CELLX))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--categories', type=int, default=len(ct.names))
+    parser.add_argument('--regions', type=int, default=50)
+    parser.add_argument('--nnz', type=int, default=10**6)
+    parser.add_argument('--limit', type=float, default=5.,
+                        help='allowed peak memory, in multiples of the grid size')
+    args = parser.parse_args()
+
+    grid = sparse_cube(args.categories, args.regions, args.nnz)
+    hg = np.random.default_rng(1).random((args.categories, 1, CELLY, CELLX))
+    dense = 8*np.prod(grid.shape, dtype=np.int64)
+    print(f'{grid}: {grid.nbytes/2**20:.1f} MB stored, {dense/2**20:.0f} MB dense')
+    print(f"{'operation':<14} {'time (s)':>9} {'peak (MB)':>10} {'x grid':>7}")
+    failed = []
+    for name, func in [('multiply', lambda: grid.multiply(hg)),
+                       ('weighted_mean', lambda: grid.weighted_mean(hg)),
+                       ('catch_limits', lambda: grid.catch_limits(hg))]:
+        t0 = time.perf_counter()
+        func()
+        t = time.perf_counter() - t0
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        ratio = peak/grid.nbytes
+        print(f'{name:<14} {t:9.3f} {peak/2**20:10.1f} {ratio:7.1f}')
+        if ratio > args.limit:
+            failed.append(name)
+    if failed:
+        sys.exit(f'peak memory above {args.limit}x the sparse grid: {", ".join(failed)}')
+
+
+if __name__ == '__main__':
+    main()
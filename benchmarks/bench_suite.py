@@ -0,0 +1,164 @@
+"""End-to-end benchmarks of the catchtools and plottools hot paths.
+
+Every case runs on synthetic inputs (see synthetic.py) and records the
+median and best wall time over --repeat runs plus the peak Python memory
+of one extra traced run. Results are written as JSON, by default to
+benchmarks/results/<git revision>.json, and --compare prints the speed
+ratio against an earlier results file. Run from the repository root:
+    python benchmarks/bench_suite.py [--size small|full] [--only regrid fill]
+                                     [--compare benchmarks/results/abc1234.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+import synthetic
+from synthetic import ct
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Problem sizes: catch table rows, grid resolutions (degrees) and plot grid
+sizes = {'small': {'rows': [10**5], 'res': [2.0, 1.0], 'plotres': [4.0]},
+         'full': {'rows': [10**5, 10**6, 10**7], 'res': [2.0, 1.0, 0.5],
+                  'plotres': [2.0, 1.0]}}
+
+
+def cases(size):
+    """(name, params, setup) for every benchmark; setup() builds the inputs
+    and returns the function to time."""
+    s = sizes[size]
+    for rows in s['rows']:
+        def setup(rows=rows):
+            table = synthetic.catch_table(rows)
+            return lambda: ct.grid_species_catch('low', table, 1)
+        yield 'grid_species_catch', {'rows': rows}, setup
+    for res in s['res']:
+        def setup(res=res):
+            field = synthetic.seawater_fields(res, ['Low'])['Low']
+            return lambda: ct.regrid_down(field)
+        yield 'regrid_down', {'res': res}, setup
+    def setup():
+        field = synthetic.seawater_fields((2, 2.5), ['Low'])['Low']
+        return lambda: ct.regrid_lon_25_2(field)
+    yield 'regrid_lon_25_2', {'res': [2, 2.5]}, setup
+    jit = getattr(ct, 'fillinzeros_kernel', lambda: None)() is not None
+    for res in s['res']:
+        def setup(res=res):
+            mask = synthetic.region_mask(res)
+            ct.fillinzeros(mask.copy())  # compile the kernel outside timing
+            return lambda: ct.fillinzeros(mask.copy())
+        yield 'fillinzeros', {'res': res, 'jit': jit}, setup
+    for res in s['res']:
+        def setup(res=res):
+            field = synthetic.gappy_field(res)
+            return lambda: ct.fill_nearest(field)
+        yield 'fill_nearest', {'res': res}, setup
+    for rows in s['rows']:
+        def setup(rows=rows):
+            table = synthetic.catch_table(rows)
+            swdata = synthetic.seawater_fields(0.5, ['Low'])
+            catch = {'low': ct.grid_species_catch('low', table, 1)}
+            return lambda: ct.map_hg_for_fish('Low', swdata, catch)
+        yield 'map_hg_for_fish', {'rows': rows, 'res': 0.5}, setup
+    for res in s['res']:
+        def setup(res=res):
+            lats, lons = synthetic.grid_coords(res)
+            return lambda: ct.gridbox_areas(lats, lons)
+        yield 'gridbox_areas', {'res': res}, setup
+    for res in s['plotres']:
+        def setup(res=res):
+            from plottools import maps
+            lats, lons = synthetic.grid_coords(res)
+            field = synthetic.seawater_fields(res, ['Low'])['Low']
+
+            def draw():
+                maps.plotmap(lons, lats, field)
+                plt.gcf().canvas.draw()
+                plt.close('all')
+            return draw
+        yield 'plotmap', {'res': res}, setup
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'median': float(np.median(times)), 'min': min(times), 'times': times,
+            'peak_bytes': peak}
+
+
+def revision():
+    def git(*args):
+        out = subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip()
+    rev = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    return rev + ('-dirty' if git('status', '--porcelain', '--untracked-files=no') else '')
+
+
+def case_key(result):
+    return f"{result['name']} {json.dumps(result['params'], sort_keys=True)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', choices=list(sizes), default='small')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='run only cases whose name contains one of these')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None, help='earlier results JSON')
+    args = parser.parse_args()
+
+    rev = revision()
+    results = []
+    print(f"{'case':<20} {'params':<28} {'median (s)':>10} {'peak (MB)':>10}")
+    for name, params, setup in cases(args.size):
+        if args.only and not any(o in name for o in args.only):
+            continue
+        result = dict(name=name, params=params, **measure(setup(), args.repeat))
+        results.append(result)
+        print(f"{name:<20} {json.dumps(params):<28} {result['median']:10.4f} "
+              f"{result['peak_bytes']/2**20:10.1f}")
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f'{rev}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    meta = {'revision': rev, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'size': args.size, 'repeat': args.repeat, 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform()}
+    with open(output, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=1)
+    print(f'results written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        before = {case_key(r): r for r in old['results']}
+        print(f"\ncompared with {old['meta']['revision']}")
+        print(f"{'case':<52} {'old (s)':>9} {'new (s)':>9} {'speedup':>8}")
+        for r in results:
+            o = before.get(case_key(r))
+            if o is not None:
+                print(f"{case_key(r):<52} {o['median']:9.4f} {r['median']:9.4f} "
+                      f"{o['median']/r['median']:7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Synthetic inputs for the benchmarks: catch tables, seawater Hg fields
+and region masks with the shapes and label sets of the real data."""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import catchtools as ct
+
+CELLX, CELLY = 720, 360
+
+# Share of catch records per Hg category: bulk categories dominate, the
+# tuna/billfish/shark categories are a long tail
+category_weights = {'very low': 0.22, 'low': 0.3, 'medium': 0.16, 'high': 0.06,
+                    'albacore': 0.02, 'bigeye': 0.02, 'skipjack': 0.06,
+                    'yellowfin': 0.04, 'other tunas': 0.03, 'blue marlin': 0.005,
+                    'billfish': 0.01, 'king mackerel': 0.01, 'pollock': 0.04,
+                    'salmon': 0.01, 'shark_high': 0.005, 'shark_low': 0.01}
+
+
+def _smooth_field(ny, nx, rng, nmodes=6):
+    """Positive smooth global field from a few random low-order modes."""
+    lat = np.linspace(-np.pi/2, np.pi/2, ny)[:, None]
+    lon = np.linspace(0, 2*np.pi, nx, endpoint=False)[None, :]
+    field = np.ones((ny, nx))
+    for k in range(1, nmodes + 1):
+        a, p, q = rng.normal(0, 1/k), rng.uniform(0, 2*np.pi), rng.uniform(0, 2*np.pi)
+        field += a*np.cos(k*lon + p)*np.cos(k*lat + q)
+    return field - field.min() + 0.1
+
+
+def cell_weights(seed=0):
+    """Relative fishing intensity per 0.5 degree cell: heavy-tailed and
+    concentrated at mid latitudes, zero near the poles (one row per latitude)."""
+    rng = np.random.default_rng(seed)
+    lats = np.linspace(-89.75, 89.75, CELLY)
+    band = np.exp(-((np.abs(lats) - 35)/25)**2)*(np.abs(lats) < 75)
+    weights = _smooth_field(CELLY, CELLX, rng)**3*band[:, None]
+    weights *= rng.lognormal(0, 1.5, weights.shape)
+    return weights/weights.sum()
+
+
+def catch_table(nrows, nregions=6, seed=0):
+    """Catch records with CellID, Catch, Hg_category and Reg columns.
+    Cells are drawn from cell_weights (so popular cells repeat), categories
+    from category_weights and regions with Zipf-like frequencies; Catch is
+    lognormal (tonnes)."""
+    rng = np.random.default_rng(seed)
+    weights = cell_weights(seed).ravel()
+    flat = rng.choice(weights.size, size=nrows, p=weights)
+    cellids = flat - 1  # catchtools adds the +1 offset back
+    cellids[cellids < 0] = 0
+    labels = list(category_weights)
+    p = np.array([category_weights[c] for c in labels])
+    categories = pd.Categorical.from_codes(rng.choice(len(labels), size=nrows, p=p/p.sum()),
+                                           categories=labels)
+    rp = 1/np.arange(1, nregions + 1)
+    regions = rng.choice(np.arange(1, nregions + 1), size=nrows, p=rp/rp.sum())
+    return pd.DataFrame({'CellID': cellids.astype(np.int64),
+                         'Catch': rng.lognormal(0, 2, nrows),
+                         'Hg_category': categories,
+                         'Reg': regions})
+
+
+def seawater_fields(res, fishes=None, seed=0):
+    """Seawater Hg field per category on a res-degree global grid
+    (res may be a (dlat, dlon) pair, e.g. (2, 2.5) for the model grid)."""
+    dlat, dlon = (res, res) if np.isscalar(res) else res
+    ny, nx = int(round(180/dlat)), int(round(360/dlon))
+    rng = np.random.default_rng(seed)
+    fishes = ct.names if fishes is None else fishes
+    return {fish: 0.2 + 0.1*_smooth_field(ny, nx, rng) for fish in fishes}
+
+
+def grid_coords(res):
+    """Cell-centre (lats, lons) of a global res-degree grid."""
+    return (np.arange(-90 + res/2, 90, res), np.arange(-180 + res/2, 180, res))
+
+
+def region_mask(res, gapfrac=0.6, seed=0):
+    """Integer region mask on a global grid of res degrees with zero gaps."""
+    ny, nx = int(round(180/res)), int(round(360/res))
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(1, 250, (18, 36))
+    mask = np.repeat(np.repeat(blocks, ny//18, axis=0), nx//36, axis=1)
+    mask[rng.random((ny, nx)) < gapfrac] = 0
+    return mask
+
+
+def gappy_field(res, nanfrac=0.3, seed=0):
+    """Smooth field with scattered NaN cells, as input for fill_nearest."""
+    ny, nx = int(round(180/res)), int(round(360/res))
+    rng = np.random.default_rng(seed)
+    field = _smooth_field(ny, nx, rng)
+    field[rng.random((ny, nx)) < nanfrac] = np.nan
+    return field
@@ -1,18 +1,51 @@
-import pylab as pl
-import matplotlib.pyplot as plt
+import hashlib
+import importlib
+import os
+import warnings
+
 import numpy as np
 # from mpl_toolkits.basemap import Basemap
-import pandas as pd
 
-from matplotlib.patches import Polygon
-from matplotlib.collections import PatchCollection, LineCollection
-from matplotlib.patches import PathPatch
-from matplotlib import cm
-import shapefile
+import hgprofile
+
+
+class _LazyModule:
+    """Module imported on first attribute access, to keep `import catchtools` light."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+pd = _LazyModule('pandas')
+sps = _LazyModule('scipy.sparse')
+
+# Plotting and shapefile names formerly imported here, loaded on first use
+_lazy_attrs = {'pl': ('pylab', None), 'plt': ('matplotlib.pyplot', None),
+               'Polygon': ('matplotlib.patches', 'Polygon'),
+               'PathPatch': ('matplotlib.patches', 'PathPatch'),
+               'PatchCollection': ('matplotlib.collections', 'PatchCollection'),
+               'LineCollection': ('matplotlib.collections', 'LineCollection'),
+               'cm': ('matplotlib.cm', None), 'shapefile': ('shapefile', None),
+               'gridspec': ('matplotlib.gridspec', None),
+               'mcolors': ('matplotlib.colors', None),
+               'Normalize': ('matplotlib.colors', 'Normalize')}
 
-import matplotlib.gridspec as gridspec
-import matplotlib.colors as mcolors
-from matplotlib.colors import Normalize
+
+def __getattr__(name):
+    if name not in _lazy_attrs:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    modname, attr = _lazy_attrs[name]
+    value = importlib.import_module(modname)
+    if attr is not None:
+        value = getattr(value, attr)
+    globals()[name] = value
+    return value
 
 # Catch categories and corresponding depth ranges
 names = ['Very low', 'Low', 'Medium', 'High',
@@ -54,13 +87,21 @@ scale_upper = {'Very low': 0.023/0.016, 'Low': 0.097/0.055,
 # Routines to spatially distribute Hg concentrations
 def calc_scaling(hg,catch):
     """Calculate normalized scaling factor."""
+    if isinstance(catch, SparseGrid):
+        scaling = hg/catch.weighted_mean(hg)
+        if hgprofile.enabled():  # catch-weighted mean, should ~equal 1.0
+            hgprofile.annotate(scaling_cwm=float(catch.weighted_mean(scaling)))
+        return scaling
     cwm = np.nansum(hg*catch)/np.nansum(catch)
     scaling = hg/cwm
-    print(np.nansum(scaling*catch)/np.nansum(catch), 'should ~equal 1.0')
+    if hgprofile.enabled():
+        hgprofile.annotate(scaling_cwm=float(np.nansum(scaling*catch)/np.nansum(catch)))
     return scaling
 
 def get_catch_limits(hg,catch):
     """Calculate min and max where catch happens."""
+    if isinstance(catch, SparseGrid):
+        return catch.catch_limits(hg)
     wherecatch = (catch>0) & (hg>0)
     hgwhere = hg[wherecatch]
     return np.min(hgwhere), np.max(hgwhere)
@@ -86,6 +127,171 @@ def map_hg_for_fish(fish, swdata, category_catch):
 
     return mid, low, high
 
+def category_params(fishes=None):
+    """Empirical Hg parameters as arrays aligned with fishes (default: names).
+    min/max are converted to MeHg as in map_hg_for_fish; lower/upper are the
+    regression bound scalings (1.0 where none is given)."""
+    fishes = names if fishes is None else fishes
+    stats = np.array([hgstats[f] for f in fishes], dtype=float)
+    tomehg = np.array([1.0 if f in ['Very low', 'Low', 'Medium', 'High'] else 0.95
+                       for f in fishes])
+    return {'mean': stats[:,0], 'min': stats[:,1]*tomehg, 'max': stats[:,2]*tomehg,
+            'lower': np.array([scale_lower.get(f, 1.0) for f in fishes]),
+            'upper': np.array([scale_upper.get(f, 1.0) for f in fishes])}
+
+def stack_categories(swdata, category_catch, fishes=None):
+    """Stack per-category dicts (as used by map_hg_for_fish) along a leading axis."""
+    fishes = names if fishes is None else fishes
+    sw = np.stack([swdata[f] for f in fishes])
+    catches = [category_catch[species_names_r[f]] for f in fishes]
+    if all(isinstance(c, SparseGrid) for c in catches):
+        catch = SparseGrid(sps.vstack([c.matrix for c in catches]),
+                           (len(fishes),) + catches[0].shape[-2:])
+    else:
+        catch = np.stack([np.asarray(c) for c in catches])
+    return sw, catch
+
+def map_hg_all(swdata_stack, catch_stack, fishes=None, diagnostics=None):
+    """Map Hg for all fish categories at once (batched map_hg_for_fish).
+    swdata_stack and catch_stack are (category, lat, lon) stacks ordered as
+    fishes (default: names); catch_stack may be a SparseGrid. Returns mid, low
+    and high stacks. If a dict is passed as diagnostics, it receives the catch
+    limits and the catch-weighted normalization (should ~equal 1.0)."""
+    fishes = names if fishes is None else fishes
+    p = category_params(fishes)
+    sw = np.asarray(swdata_stack, dtype=float)
+    catch = catch_stack
+    if isinstance(catch, SparseGrid):
+        mmin, mmax = catch.catch_limits(sw)
+    else:
+        catch = np.asarray(catch)
+        wherecatch = (catch>0) & (sw>0)
+        mmin = np.min(sw, axis=(-2,-1), where=wherecatch, initial=np.inf)
+        mmax = np.max(sw, axis=(-2,-1), where=wherecatch, initial=-np.inf)
+        mmin[np.isinf(mmin)] = np.nan
+        mmax[np.isinf(mmax)] = np.nan
+
+    expand = lambda a: np.asarray(a)[:,None,None]
+    # make max:min ratio equal empirical
+    prescl = sw*expand(p['max']-p['min'])/expand(mmax)+expand(p['min'])
+    # normalize by catch-weighted mean, then scale to empirical mean
+    if isinstance(catch, SparseGrid):
+        cwm = catch.weighted_mean(prescl)
+    else:
+        cwm = np.nansum(prescl*catch, axis=(-2,-1))/np.nansum(catch, axis=(-2,-1))
+    mid = prescl/expand(cwm)*expand(p['mean'])
+    low = mid*expand(p['lower'])
+    high = mid*expand(p['upper'])
+
+    if diagnostics is not None:
+        scl = mid/expand(p['mean'])
+        if isinstance(catch, SparseGrid):
+            norm = catch.weighted_mean(scl)
+        else:
+            norm = np.nansum(scl*catch, axis=(-2,-1))/np.nansum(catch, axis=(-2,-1))
+        diagnostics['catch_limits'] = (mmin, mmax)
+        diagnostics['normalization'] = norm
+    return mid, low, high
+
+# Monte Carlo uncertainty on the Hg mapping
+def draw_params(n, fishes=None, spatial=(1.0, 1.0), seed=None):
+    """Draw n parameter sets for each fish category (default: names).
+    mean: empirical mean, triangular over hgstats (min, mean, max).
+    bound: regression bound scaling, uniform in [scale_lower, scale_upper].
+    spatial: strength of the spatial scaling (1 = as mapped, 0 = no spatial
+    variation), uniform in the given range.
+    Returns a dict of (n, category) arrays."""
+    fishes = names if fishes is None else fishes
+    rng = np.random.default_rng(seed)
+    stats = np.array([hgstats[f] for f in fishes], dtype=float)
+    p = category_params(fishes)
+    shape = (n, len(fishes))
+    return {'mean': rng.triangular(stats[:,1], stats[:,0], stats[:,2], shape),
+            'bound': rng.uniform(p['lower'], p['upper'], shape),
+            'spatial': rng.uniform(spatial[0], spatial[1], shape)}
+
+def _catch_sums(sw, catch, ids=None, nids=1):
+    """Catch-weighted sums of sw and catch over finite sw, per category (and ID)."""
+    if isinstance(catch, SparseGrid):
+        rows = np.repeat(np.arange(catch.nfields), np.diff(catch.matrix.indptr))
+        cells = catch.matrix.indices
+        cvals = np.nan_to_num(catch.matrix.data)
+    else:
+        catch = np.asarray(catch).ravel()
+        flat = np.flatnonzero(catch)
+        rows, cells = np.divmod(flat, sw.shape[-2]*sw.shape[-1])
+        cvals = np.nan_to_num(catch[flat])
+    swvals = sw.reshape(len(sw), -1)[rows, cells]
+    finite = np.isfinite(swvals)
+    key = rows*nids if ids is None else rows*nids + ids.ravel()[cells]
+    shape = (len(sw), nids)
+    swsum = np.bincount(key[finite], weights=(swvals*cvals)[finite],
+                        minlength=len(sw)*nids).reshape(shape)
+    csum = np.bincount(key[finite], weights=cvals[finite], minlength=len(sw)*nids).reshape(shape)
+    total = np.bincount(key, weights=cvals, minlength=len(sw)*nids).reshape(shape)
+    return swsum, csum, total
+
+def montecarlo_hg(swdata_stack, catch_stack, n=1000, fishes=None, params=None,
+                  quantiles=(0.05, 0.5, 0.95), eez_ids=None, percell=True,
+                  chunkbytes=2**27, seed=None, **drawargs):
+    """Monte Carlo distributions of the mapped Hg (see map_hg_for_fish).
+    Parameter sets come from draw_params (or params). Each draw rescales the
+    map analytically from catch-weighted sums computed once, so all draws are
+    evaluated as array operations. Per-cell quantiles are computed over
+    chunks of cells holding all draws, limited to about chunkbytes each.
+    Returns a dict with the params, 'cell_quantiles' (quantile, category,
+    lat, lon) and, if an integer EEZ ID raster is given, 'eez_ids' and
+    'eez_quantiles' (quantile, eez) of the catch-weighted mean over all
+    categories."""
+    fishes = names if fishes is None else fishes
+    if params is None:
+        params = draw_params(n, fishes, seed=seed, **drawargs)
+    p = category_params(fishes)
+    sw = np.asarray(swdata_stack, dtype=float)
+    ncat = len(fishes)
+    ny, nx = sw.shape[-2:]
+
+    # prescl = spatial*a*sw + b with a = (max-min)/mmax, b = min (map_hg_for_fish)
+    if isinstance(catch_stack, SparseGrid):
+        mmax = catch_stack.catch_limits(sw)[1]
+    else:
+        wherecatch = (np.asarray(catch_stack)>0) & (sw>0)
+        mmax = np.max(sw, axis=(-2,-1), where=wherecatch, initial=-np.inf)
+        mmax[np.isinf(mmax)] = np.nan
+    a = (p['max']-p['min'])/mmax
+    b = p['min']
+    swsum, csum, total = [x[:,0] for x in _catch_sums(sw, catch_stack)]
+    alpha = params['spatial']*a
+    # catch-weighted mean of prescl for every draw, and the map's scale factor
+    cwm = (alpha*swsum + b*csum)/total
+    factor = params['mean']*params['bound']/cwm
+    out = dict(params)
+
+    if percell:
+        q = np.asarray(quantiles)
+        cellq = np.empty((len(q), ncat, ny*nx))
+        step = max(1, int(chunkbytes // (8*len(factor))))
+        for k in range(ncat):
+            swk = sw[k].ravel()
+            for i in range(0, ny*nx, step):
+                vals = (alpha[:,k,None]*swk[None,i:i+step] + b[k])*factor[:,k,None]
+                cellq[:,k,i:i+step] = np.quantile(vals, q, axis=0)
+        out['cell_quantiles'] = cellq.reshape(len(q), ncat, ny, nx)
+
+    if eez_ids is not None:
+        ids = np.unique(eez_ids)
+        ids = ids[ids > 0]
+        codes = np.searchsorted(ids, eez_ids)
+        codes[~np.isin(eez_ids, ids)] = len(ids)
+        eswsum, ecsum, etotal = _catch_sums(sw, catch_stack, codes, len(ids)+1)
+        # sum over categories of catch*map in each EEZ, for every draw
+        hgcatch = np.einsum('dk,dke->de', factor, alpha[:,:,None]*eswsum[None]
+                            + (b[:,None]*ecsum)[None])
+        eezmean = hgcatch[:,:-1]/etotal.sum(axis=0)[:-1]
+        out['eez_ids'] = ids
+        out['eez_quantiles'] = np.quantile(eezmean, quantiles, axis=0)
+    return out
+
 
 # Country and EEZ info
 eezname_to_index = {
@@ -514,50 +720,464 @@ eezname_to_faoname = {
     'Wallis & Futuna Isl. (France)': 'Wallis and Futuna Isl. (France)',
 }
 
+# EEZ IDs shared by more than one EEZ name (912: Kara Sea and Laptev to Chukchi Sea)
+eezindex_to_names = {}
+for _name, _index in eezname_to_index.items():
+    eezindex_to_names.setdefault(_index, []).append(_name)
+del _name, _index
+eez_shared_ids = {i: n for i, n in eezindex_to_names.items() if len(n) > 1}
+# one label per raster ID; shared IDs get the joined names
+eezindex_to_label = {i: ' / '.join(n) for i, n in eezindex_to_names.items()}
+
+def eez_membership(eez_ids):
+    """Known EEZ IDs on an ID raster and the sparse (cell, EEZ) membership
+    matrix over its flattened cells. Returns (ids, member, unmatched_ids)."""
+    eez_ids = np.asarray(eez_ids).ravel()
+    known = np.array(sorted(eezindex_to_names))
+    present = np.unique(eez_ids)
+    ids = np.intersect1d(present, known)
+    codes = np.searchsorted(ids, eez_ids)
+    inside = np.isin(eez_ids, ids)
+    member = sps.csr_matrix((np.ones(inside.sum()), (np.flatnonzero(inside), codes[inside])),
+                            shape=(len(eez_ids), len(ids)))
+    return ids, member, present[(present > 0) & ~np.isin(present, known)]
+
+def aggregate_eez(eez_ids, fields, catch=None):
+    """Per-EEZ sums and catch-weighted means of a stack of gridded fields.
+    eez_ids is an integer (lat,lon) raster of eezname_to_index IDs; fields is
+    (..., lat, lon), e.g. (category, lat, lon) Hg maps, and catch (dense or
+    SparseGrid) broadcasts against it. All fields are reduced with one
+    sparse product against the EEZ membership matrix; NaNs are ignored.
+    IDs shared by several names (eez_shared_ids, e.g. 912) cannot be told
+    apart on a raster and are reported once under their joined label.
+    Returns a dict with 'ids', 'eez' (labels), 'sum' (..., eez) and, with
+    catch, 'catch' totals and 'mean'. Raster IDs > 0 not in eezname_to_index
+    are listed in 'unmatched_ids'."""
+    ids, member, unmatched = eez_membership(eez_ids)
+    ncells = member.shape[0]
+
+    fields = np.asarray(fields, dtype=float)
+    lead = fields.shape[:-2]
+    flat = fields.reshape(-1, ncells)
+    out = {'ids': ids, 'eez': [eezindex_to_label[i] for i in ids],
+           'unmatched_ids': unmatched}
+    out['sum'] = np.asarray(np.nan_to_num(flat) @ member).reshape(lead + (len(ids),))
+    if catch is not None:
+        if isinstance(catch, SparseGrid):
+            weighted = catch.multiply(fields)
+            weighted.matrix.data = np.nan_to_num(weighted.matrix.data)
+            wsum = (weighted.matrix @ member).toarray().reshape(weighted.shape[:-2] + (len(ids),))
+            wtot = (catch.matrix @ member).toarray().reshape(catch.shape[:-2] + (len(ids),))
+        else:
+            catch = np.asarray(catch, dtype=float)
+            both = np.broadcast_shapes(catch.shape, fields.shape)
+            weighted = np.nan_to_num(catch*fields).reshape(-1, ncells)
+            wsum = np.asarray(weighted @ member).reshape(both[:-2] + (len(ids),))
+            wtot = np.asarray(np.nan_to_num(catch).reshape(-1, ncells) @ member)
+            wtot = wtot.reshape(catch.shape[:-2] + (len(ids),))
+        out['catch'] = wtot
+        shape = np.broadcast_shapes(wsum.shape, wtot.shape)
+        out['mean'] = np.divide(wsum, wtot, out=np.full(shape, np.nan), where=wtot>0)
+    return out
+
+class CountryRollup:
+    """Precompiled EEZ -> FAO country index (see build_country_rollup).
+    ids are EEZ raster IDs, countries the sorted country names and
+    country_code[i] the country of ids[i]; matrix is the (eez, country)
+    membership used to roll up whole arrays at once."""
+
+    def __init__(self, ids, countries, country_code, unmapped, islands):
+        self.ids = np.asarray(ids)
+        self.countries = list(countries)
+        self.country_code = np.asarray(country_code)
+        self.unmapped = unmapped
+        self.islands = islands
+        self.matrix = sps.csr_matrix((np.ones(len(self.ids)), (np.arange(len(self.ids)),
+                                     self.country_code)),
+                                     shape=(len(self.ids), len(self.countries)))
+
+    def _rows(self, ids):
+        if ids is None:
+            return self.matrix
+        ids = np.asarray(ids)
+        pos = np.searchsorted(self.ids, ids)
+        if np.any(pos >= len(self.ids)) or np.any(self.ids[np.minimum(pos, len(self.ids)-1)] != ids):
+            raise KeyError(f'EEZ IDs not in rollup: {np.setdiff1d(ids, self.ids)}')
+        return self.matrix[pos]
+
+    def sum(self, values, ids=None):
+        """Country sums of a (..., eez) array ordered as ids (default: self.ids)."""
+        values = np.asarray(values, dtype=float)
+        flat = np.nan_to_num(values.reshape(-1, values.shape[-1]))
+        return np.asarray(flat @ self._rows(ids)).reshape(values.shape[:-1] + (len(self.countries),))
+
+    def mean(self, values, weights, ids=None):
+        """Weighted (e.g. catch-weighted) country means of per-EEZ means."""
+        values = np.asarray(values, dtype=float)
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), values.shape)
+        num = self.sum(np.nan_to_num(values*weights), ids)
+        den = self.sum(np.where(np.isnan(values), 0., weights), ids)
+        return np.divide(num, den, out=np.full(num.shape, np.nan), where=den>0)
+
+def build_country_rollup(ids=None, warn=True):
+    """Compile eezname_to_faoname into an integer EEZ -> country index.
+    ids defaults to all eezname_to_index IDs. EEZ names missing from
+    eezname_to_faoname keep their own name as country and are listed in
+    unmapped; those mapped to the catch-all 'Islands' are listed in islands.
+    Both are reported once here (warnings) rather than at query time."""
+    ids = np.array(sorted(eezindex_to_names) if ids is None else sorted(ids))
+    eezcountries, unmapped, islands = [], [], []
+    for i in ids:
+        found = set()
+        for name in eezindex_to_names[i]:
+            if name not in eezname_to_faoname:
+                unmapped.append(name)
+            elif eezname_to_faoname[name] == 'Islands':
+                islands.append(name)
+            found.add(eezname_to_faoname.get(name, name))
+        if len(found) > 1:
+            raise ValueError(f'EEZ ID {i} maps to several countries: {sorted(found)}')
+        eezcountries.append(found.pop())
+    countries, codes = np.unique(eezcountries, return_inverse=True)
+    if warn and (unmapped or islands):
+        warnings.warn(f'{len(unmapped)} EEZs have no FAO name and keep their own; '
+                      f'{len(islands)} EEZs are merged into "Islands"', stacklevel=2)
+    return CountryRollup(ids, countries.tolist(), codes.ravel(), unmapped, islands)
+
+def eez_frame(values, eez, columns=None):
+    """DataFrame indexed by EEZ label from a (..., eez) array of aggregate_eez."""
+    values = np.asarray(values)
+    return pd.DataFrame(values.reshape(-1, values.shape[-1]).T, index=pd.Index(eez, name='EEZ'),
+                        columns=columns)
+
+def select_catch(species,catchdata,region,regionheader='Reg'):
+    """Return CellID and Catch values for one Hg category and region."""
+    sel = (catchdata['Hg_category'] == species) & (catchdata[regionheader] == region)
+    return catchdata['CellID'][sel].values, catchdata['Catch'][sel].values
+
+def catch_cell_index(cellids,cellx=720,celly=360):
+    """Flat (lat,lon) grid index of each catch record's cell.
+    Applies the +1 cell-id offset and one-column westward roll of grid_species_catch."""
+    celltotal = cellx*celly
+    flat = np.asarray(cellids).astype(np.int64) + 1
+    if flat.size and (flat.min() < 0 or flat.max() >= celltotal):
+        raise ValueError(f'CellID outside of grid with {celltotal} cells')
+    row, col = np.divmod(flat, cellx)
+    return row*cellx + (col-1) % cellx
+
+def bin_catch(cellids,catch,cellid_grid=None,cellx=720,celly=360):
+    """Scatter-add catch records onto the grid in one pass.
+    Catch in duplicate cell IDs is summed. Cell IDs are offset by +1 and
+    the result is rolled one column west, as in grid_species_catch."""
+    cellids = np.asarray(cellids)
+    catch = np.asarray(catch, dtype=float)
+    if cellid_grid is not None:
+        cellid_grid = np.asarray(cellid_grid)
+        uids, inv = np.unique(cellids.astype(float), return_inverse=True)
+        totals = np.bincount(inv.ravel(), weights=catch, minlength=len(uids))
+        if len(uids) == 0:
+            gridded = np.zeros(cellid_grid.shape)
+        else:
+            pos = np.clip(np.searchsorted(uids, cellid_grid), 0, len(uids)-1)
+            gridded = np.where(uids[pos] == cellid_grid, totals[pos], 0.)
+        return np.roll(gridded, -1, axis=1)
+
+    gridded = np.bincount(catch_cell_index(cellids,cellx,celly), weights=catch,
+                          minlength=cellx*celly)
+    return np.reshape(gridded,(celly,cellx))
+
 def grid_species_catch(species,catchdata,region,cellid_grid=None,cellx=720,celly=360,
                        regionheader='Reg'):
-    cellids = catchdata['CellID']\
-        [catchdata['Hg_category'] == species][catchdata[regionheader] == region].values
-    catch = catchdata['Catch'][catchdata['Hg_category'] == species]\
-        [catchdata[regionheader] == region].values
-    gridded = np.zeros_like(cellid_grid)
+    """Grid catch of one Hg category in one region (see bin_catch)."""
+    cellids, catch = select_catch(species,catchdata,region,regionheader)
+    return bin_catch(cellids,catch,cellid_grid=cellid_grid,cellx=cellx,celly=celly)
+
+def build_catch_cube(catchdata,regionheader='Reg',categories=None,regions=None,
+                     cellx=720,celly=360,sparse=False):
+    """Grid catch for every (Hg category, region) pair in one pass over catchdata.
+    categories defaults to the catch labels of all entries in names, regions to
+    every region present. Records outside these labels are dropped.
+    Returns (cube, categories, regions). cube is a dense (category, region, lat, lon)
+    array, or with sparse=True a SparseGrid of the same shape."""
+    if categories is None:
+        categories = [species_names_r[n] for n in names]
+    categories = list(categories)
+    regcol = catchdata[regionheader].values
+    if regions is None:
+        regions = np.unique(regcol)
+    regions = np.asarray(regions)
+
+    cat_codes = pd.Categorical(catchdata['Hg_category'].values,
+                               categories=categories).codes
+    reg_codes = pd.Index(regions).get_indexer(regcol)
+    keep = (cat_codes >= 0) & (reg_codes >= 0)
+    pair = cat_codes[keep].astype(np.int64)*len(regions) + reg_codes[keep]
+    cell = catch_cell_index(catchdata['CellID'].values[keep],cellx,celly)
+    catch = catchdata['Catch'].values[keep].astype(float)
+    cube = _assemble_cube(pair, cell, catch, (len(categories),len(regions)),
+                          cellx, celly, sparse)
+    return cube, categories, regions
+
+def _assemble_cube(pair, cell, catch, lead, cellx, celly, sparse):
+    """Sum catch into a (*lead, lat, lon) cube from flat pair and cell indices."""
+    npairs = int(np.prod(lead))
     celltotal = cellx*celly
-    gridded_flat = np.zeros(celltotal)
-    for i,cid in enumerate(cellids):
-        if cellid_grid:
-            gridded = np.where(cellid_grid==float(cid),float(catch[i]),gridded)
-        else:
-            gridded_flat[int(cid)+1] = catch[i]
-    if not cellid_grid:
-        gridded = np.reshape(gridded_flat,(celly,cellx))
-    gridded_out = np.zeros_like(gridded)
-    gridded_out[:,:-1] = gridded[:,1:]
-    gridded_out[:,-1] = gridded[:,0]
+    if sparse:
+        cube = sps.csr_matrix((catch, (pair, cell)), shape=(npairs, celltotal))
+        cube.sum_duplicates()
+        return SparseGrid(cube, tuple(lead) + (celly,cellx))
+    cube = np.bincount(pair*celltotal + cell, weights=catch, minlength=npairs*celltotal)
+    return np.reshape(cube, tuple(lead) + (celly,cellx))
 
-    return gridded_out
+def _catch_category_keys(chunk_categories):
+    """Map catch category labels (keys or display names of species_names) to keys."""
+    renamed = [species_names_r.get(c, c) for c in chunk_categories]
+    unknown = sorted(set(renamed) - set(species_names))
+    if unknown:
+        raise ValueError(f'Unknown Hg_category values: {unknown}')
+    return renamed
 
+def read_catch_chunks(path, chunksize=10**6, regionheader='Reg', **kwargs):
+    """Read a catch CSV in chunks with compact dtypes.
+    Hg_category and the region column become categoricals (categories
+    validated against species_names, display names translated to keys),
+    CellID becomes int32 and Catch float64. Only these four columns are read.
+    Extra keyword arguments go to pandas.read_csv."""
+    catdtype = pd.CategoricalDtype(list(species_names))
+    columns = ['CellID', 'Catch', 'Hg_category', regionheader]
+    reader = pd.read_csv(path, usecols=columns, chunksize=chunksize,
+                         dtype={'CellID': 'float64', 'Catch': 'float64',
+                                'Hg_category': 'category', regionheader: 'category'},
+                         **kwargs)
+    for chunk in reader:
+        cats = chunk['Hg_category'].cat
+        lookup = catdtype.categories.get_indexer(_catch_category_keys(cats.categories))
+        chunk['Hg_category'] = pd.Categorical.from_codes(
+            np.append(lookup, -1)[cats.codes.values], dtype=catdtype)
+        regcats = chunk[regionheader].cat.categories
+        numeric = pd.to_numeric(regcats, errors='coerce')
+        if not np.any(np.isnan(numeric)):
+            chunk[regionheader] = chunk[regionheader].cat.rename_categories(numeric)
+        cellid = chunk['CellID'].values
+        if np.any(cellid != np.floor(cellid)):
+            raise ValueError('Non-integer CellID values')
+        chunk['CellID'] = cellid.astype(np.int32)
+        yield chunk
 
-def regrid_down(gridded, intrinsic=1):
-    gridlength,gridwidth = np.shape(gridded);
-    regridded = np.zeros((gridlength*2,gridwidth*2));
-    
-    if intrinsic:
-        A = 1.
+def read_catch(path, **kwargs):
+    """Read a whole catch CSV with the compact dtypes of read_catch_chunks."""
+    chunks = list(read_catch_chunks(path, **kwargs))
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+def build_catch_cube_chunked(chunks, regionheader='Reg', categories=None, regions=None,
+                             cellx=720, celly=360, sparse=False, mergeevery=10**7):
+    """build_catch_cube over an iterable of catch DataFrames (e.g. read_catch_chunks).
+    Each chunk is reduced to summed (category, region, cell) entries right away,
+    so memory scales with the number of distinct catch cells, not raw records.
+    Accumulated entries are merged whenever more than mergeevery are held."""
+    if categories is None:
+        categories = [species_names_r[n] for n in names]
+    categories = list(categories)
+    ncat = len(categories)
+    celltotal = cellx*celly
+    fixed = regions is not None
+    regindex = pd.Index(regions if fixed else [])
+
+    def merge(keys, sums):
+        keys = np.concatenate(keys)
+        ukeys, inv = np.unique(keys, return_inverse=True)
+        return [ukeys], [np.bincount(inv.ravel(), weights=np.concatenate(sums))]
+
+    keys, sums = [], []
+    held = 0
+    for chunk in chunks:
+        regcol = chunk[regionheader].values
+        if not fixed:
+            newregs = pd.Index(pd.unique(regcol)).difference(regindex)
+            regindex = regindex.append(newregs)
+        cat_codes = pd.Categorical(np.asarray(chunk['Hg_category'].values),
+                                   categories=categories).codes
+        reg_codes = regindex.get_indexer(regcol)
+        keep = (cat_codes >= 0) & (reg_codes >= 0)
+        cell = catch_cell_index(chunk['CellID'].values[keep], cellx, celly)
+        key = (reg_codes[keep].astype(np.int64)*ncat + cat_codes[keep])*celltotal + cell
+        k, s = merge([key], [chunk['Catch'].values[keep].astype(float)])
+        keys += k
+        sums += s
+        held += len(k[0])
+        if held > mergeevery:
+            keys, sums = merge(keys, sums)
+            held = len(keys[0])
+
+    key, catch = merge(keys, sums) if keys else ([np.zeros(0, np.int64)], [np.zeros(0)])
+    key, catch = key[0], catch[0]
+    reg, rest = np.divmod(key, ncat*celltotal)
+    cat, cell = np.divmod(rest, celltotal)
+    if fixed:
+        regions = np.asarray(regions)
     else:
-        A = 4.
+        regions = np.sort(np.asarray(regindex))
+        reg = pd.Index(regions).get_indexer(np.asarray(regindex)[reg])
+    pair = cat*len(regions) + reg
+    cube = _assemble_cube(pair, cell, catch, (ncat,len(regions)), cellx, celly, sparse)
+    return cube, categories, regions
 
-    for i in range(gridlength):
-        for j in range(gridwidth):
-            regridded[2*i-1,2*j-1] = gridded[i,j]/A
-            regridded[2*i,2*j-1] = gridded[i,j]/A
-            regridded[2*i-1,2*j] = gridded[i,j]/A
-            regridded[2*i,2*j] = gridded[i,j]/A
-    #regridded = regridded[2:gridlength*2-1,:]
-    regridded = regridded[:,:]
 
-    return regridded
+class SparseGrid:
+    """Stack of mostly-zero gridded fields (e.g. catch) stored as CSR.
+    Each row of the matrix is one (lat,lon) field flattened in C order; any
+    leading dimensions such as (category, region) are flattened into rows."""
+
+    def __init__(self, matrix, shape):
+        self.matrix = sps.csr_matrix(matrix)
+        self.shape = tuple(shape)
+        if self.matrix.shape != (self.nfields, self.ncells):
+            raise ValueError(f'matrix of shape {self.matrix.shape} does not match {self.shape}')
+
+    @classmethod
+    def from_dense(cls, grid):
+        """Build from a dense (..., lat, lon) array."""
+        grid = np.asarray(grid)
+        ny, nx = grid.shape[-2:]
+        return cls(sps.csr_matrix(grid.reshape(-1, ny*nx)), grid.shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nfields(self):
+        return int(np.prod(self.shape[:-2], dtype=np.int64))
+
+    @property
+    def ncells(self):
+        return self.shape[-2]*self.shape[-1]
+
+    @property
+    def nnz(self):
+        return self.matrix.nnz
+
+    @property
+    def nbytes(self):
+        m = self.matrix
+        return m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+
+    def __repr__(self):
+        return f'SparseGrid(shape={self.shape}, nnz={self.nnz})'
+
+    def __getitem__(self, key):
+        """Index the leading (non-grid) dimensions only."""
+        rows = np.arange(self.nfields).reshape(self.shape[:-2])[key]
+        return SparseGrid(self.matrix[np.ravel(rows)], np.shape(rows) + self.shape[-2:])
+
+    def todense(self):
+        return self.matrix.toarray().reshape(self.shape)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.todense()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def _reduce(self, perfield):
+        if self.ndim == 2:
+            return perfield[0]
+        return perfield.reshape(self.shape[:-2])
+
+    def _gather(self, field):
+        """Values of a dense field at each stored cell, broadcasting over rows.
+        Each stored row is mapped to its row of the field's own leading shape,
+        so the field is never expanded to the full grid shape."""
+        field = np.asarray(field)
+        lead = field.shape[:-2]
+        field = np.broadcast_to(field, lead + self.shape[-2:])
+        nf = int(np.prod(lead, dtype=np.int64))
+        rows = np.repeat(np.arange(self.nfields), np.diff(self.matrix.indptr))
+        if nf > 1:
+            rows = np.broadcast_to(np.arange(nf).reshape(lead), self.shape[:-2]).ravel()[rows]
+        else:
+            rows = np.zeros_like(rows)
+        return field.reshape(nf, self.ncells)[rows, self.matrix.indices]
+
+    def _rowsum(self, data):
+        m = self.matrix
+        return np.asarray(sps.csr_matrix((data, m.indices, m.indptr),
+                                            shape=m.shape).sum(axis=1)).ravel()
+
+    def sum(self):
+        """Total of each field."""
+        return self._reduce(self._rowsum(np.nan_to_num(self.matrix.data)))
+
+    def weighted_mean(self, field):
+        """Mean of field weighted by each stored field, as in calc_scaling."""
+        num = self._rowsum(np.nan_to_num(self._gather(field)*self.matrix.data))
+        den = self._rowsum(np.nan_to_num(self.matrix.data))
+        return self._reduce(num/den)
+
+    def multiply(self, field):
+        """Elementwise product with a dense field (e.g. Hg map), staying sparse."""
+        m = self.matrix
+        data = m.data*self._gather(field)
+        return SparseGrid(sps.csr_matrix((data, m.indices.copy(), m.indptr.copy()),
+                                            shape=m.shape), self.shape)
+
+    def __mul__(self, other):
+        if np.isscalar(other):
+            return SparseGrid(self.matrix*other, self.shape)
+        return self.multiply(other)
+
+    __rmul__ = __mul__
+
+    def __add__(self, other):
+        if not isinstance(other, SparseGrid) or other.shape != self.shape:
+            return NotImplemented
+        return SparseGrid(self.matrix + other.matrix, self.shape)
+
+    def mask(self):
+        """Dense boolean mask of cells with positive values."""
+        m = self.matrix
+        positive = sps.csr_matrix((m.data > 0, m.indices, m.indptr), shape=m.shape)
+        return positive.toarray().reshape(self.shape)
+
+    def catch_limits(self, hg):
+        """Min and max of hg where catch happens, as in get_catch_limits.
+        For a stack, returns arrays with NaN for fields without catch."""
+        hgwhere = self._gather(hg)
+        valid = (self.matrix.data > 0) & (hgwhere > 0)
+        if self.ndim == 2:
+            hgwhere = hgwhere[valid]
+            return np.min(hgwhere), np.max(hgwhere)
+        rows = np.repeat(np.arange(self.nfields), np.diff(self.matrix.indptr))[valid]
+        hgmin = np.full(self.nfields, np.inf)
+        hgmax = np.full(self.nfields, -np.inf)
+        np.minimum.at(hgmin, rows, hgwhere[valid])
+        np.maximum.at(hgmax, rows, hgwhere[valid])
+        hgmin[np.isinf(hgmin)] = np.nan
+        hgmax[np.isinf(hgmax)] = np.nan
+        return self._reduce(hgmin), self._reduce(hgmax)
+
+
+def regrid_refine(grid, fy, fx, intrinsic=True, legacy_wrap=False):
+    """Refine a (..., lat, lon) grid by integer factors fy, fx.
+    Each cell is copied into an fy x fx block; for extensive quantities
+    (intrinsic=False) the value is split evenly across the block.
+    legacy_wrap=True shifts blocks back by half a block with wrap-around, the
+    layout produced by the original loop-based regrid_down."""
+    grid = np.asarray(grid, dtype=float)
+    ny, nx = grid.shape[-2:]
+    lead = grid.shape[:-2]
+    if not intrinsic:
+        grid = grid/(fy*fx)
+    refined = np.broadcast_to(grid[..., :, None, :, None], lead + (ny, fy, nx, fx))
+    refined = refined.reshape(lead + (ny*fy, nx*fx))
+    if legacy_wrap:
+        refined = np.roll(refined, (-(fy//2), -(fx//2)), axis=(-2, -1))
+    return refined
+
+def regrid_down(gridded, intrinsic=1):
+    """Refine grid 2x2, keeping the original wrap-around layout (see regrid_refine)."""
+    return regrid_refine(gridded, 2, 2, intrinsic=intrinsic, legacy_wrap=True)
 
 def regrid_lon_25_2(gridded,intrinsic=1):
+    """Regrid 2.5 deg to 2 deg longitude (legacy layout; see regrid_conservative)."""
     gridlength,gridwidth = np.shape(gridded);
     downgridded = np.zeros((gridlength,gridwidth*5));
     newgridwidth = gridwidth*5//4
@@ -588,32 +1208,227 @@ def regrid_lon_25_2(gridded,intrinsic=1):
     
     return regridded
 
-def fillinzeros(mask, fillthreshold=1):
-    masklength,maskwidth = np.shape(mask)
+# Conservative remapping between arbitrary regular lat/lon grids
+_remap_cache = {}
+remap_version = 2  # part of the cache keys; bump whenever the weights change
+remap_cachedir = os.environ.get('CATCHTOOLS_REMAP_CACHE',
+                                os.path.join(os.path.expanduser('~'), '.cache', 'catchtools'))
+
+def cell_edges(centers):
+    """Cell edges from (monotonic) cell centers."""
+    c = np.asarray(centers, dtype=float)
+    mid = (c[1:]+c[:-1])/2
+    return np.concatenate(([c[0]-(c[1]-c[0])/2], mid, [c[-1]+(c[-1]-c[-2])/2]))
+
+def _overlaps(src_edges, dst_edges, period=None):
+    """1D overlap lengths between source and target cells, shape (ndst, nsrc).
+    Edges may run in either direction (e.g. latitudes from north to south)."""
+    shifts = [0.] if period is None else [-period, 0., period]
+    dlo = np.minimum(dst_edges[:-1], dst_edges[1:])[:,None]
+    dhi = np.maximum(dst_edges[:-1], dst_edges[1:])[:,None]
+    slo = np.minimum(src_edges[:-1], src_edges[1:])[None,:]
+    shi = np.maximum(src_edges[:-1], src_edges[1:])[None,:]
+    over = 0.
+    for shift in shifts:
+        over = over + np.clip(np.minimum(dhi, shi+shift) - np.maximum(dlo, slo+shift), 0, None)
+    return over
+
+def remap_weights(src_lats, src_lons, dst_lats, dst_lons, intrinsic=True, cachedir=None):
+    """Sparse conservative remapping matrix from a source to a target lat/lon grid.
+    Grids are given by cell centers, ascending or descending. Weights are
+    spherical overlap areas, normalized per target cell for intrinsic
+    quantities (area-weighted mean) or per source cell for extensive ones
+    (sum, conserving totals). Matrices are cached in memory and as .npz files
+    in cachedir (default: remap_cachedir; False keeps them in memory only)."""
+    cachedir = remap_cachedir if cachedir is None else cachedir
+    grids = [np.ascontiguousarray(x, dtype=float) for x in
+             (src_lats, src_lons, dst_lats, dst_lons)]
+    h = hashlib.sha1(repr([remap_version, bool(intrinsic)] + [g.shape for g in grids]).encode())
+    for g in grids:
+        h.update(g.tobytes())
+    key = h.hexdigest()
+    if key in _remap_cache:
+        return _remap_cache[key]
+    fname = os.path.join(cachedir, f'remap_{key}.npz') if cachedir else None
+    if fname is not None and os.path.exists(fname):
+        weights = sps.load_npz(fname).tocsr()
+        _remap_cache[key] = weights
+        return weights
+
+    slat, slon, dlat, dlon = [cell_edges(g) for g in grids]
+    sinlat = lambda e: np.sin(np.deg2rad(np.clip(e, -90, 90)))
+    wlat = _overlaps(sinlat(slat), sinlat(dlat))
+    wlon = _overlaps(slon, dlon, period=360.)
+    if intrinsic:
+        for w in (wlat, wlon):
+            tot = w.sum(axis=1, keepdims=True)
+            np.divide(w, tot, out=w, where=tot>0)
+    else:
+        wlat /= np.abs(np.diff(sinlat(slat)))[None,:]
+        wlon /= np.abs(np.diff(slon))[None,:]
+    weights = sps.kron(sps.csr_matrix(wlat), sps.csr_matrix(wlon), format='csr')
+    weights.eliminate_zeros()
+
+    if fname is not None:
+        try:
+            os.makedirs(cachedir, exist_ok=True)
+            sps.save_npz(fname, weights)
+        except OSError:  # e.g. read-only cache location; keep the memory cache
+            pass
+    _remap_cache[key] = weights
+    return weights
+
+def apply_remap(weights, fields, dst_shape):
+    """Apply a remap_weights matrix to a (..., lat, lon) field or stack of fields."""
+    fields = np.asarray(fields, dtype=float)
+    lead = fields.shape[:-2]
+    flat = fields.reshape(-1, fields.shape[-2]*fields.shape[-1])
+    out = (weights @ flat.T).T
+    return np.reshape(out, lead + tuple(dst_shape))
+
+def regrid_conservative(gridded, src_lats, src_lons, dst_lats, dst_lons,
+                        intrinsic=True, cachedir=None):
+    """Conservatively regrid (a stack of) fields between lat/lon grids."""
+    weights = remap_weights(src_lats, src_lons, dst_lats, dst_lons,
+                            intrinsic=intrinsic, cachedir=cachedir)
+    return apply_remap(weights, gridded, (len(dst_lats), len(dst_lons)))
+
+def _fillinzeros_loop(mask, fillthreshold):
+    masklength,maskwidth = mask.shape
+    for i in range(masklength):
+        for j in range(maskwidth):
+            if mask[i, j] < fillthreshold:
+                a = mask[i, j-1 if j > 0 else maskwidth-1]
+                b = mask[i-1 if i > 0 else masklength-1, j]
+                if a == b:
+                    mask[i, j] = a
+                elif b > 0:
+                    mask[i, j] = b
+                else:
+                    mask[i, j] = a
+
+def _fillinzeros_rows(rows, fillthreshold):
+    """Same propagation as _fillinzeros_loop on nested lists (pure-Python fallback)."""
+    masklength,maskwidth = len(rows), len(rows[0])
     for i in range(masklength):
+        row, above = rows[i], rows[i-1]
         for j in range(maskwidth):
-            if mask[i,j] < fillthreshold:
-                a = mask[i,j-1]
-                b = mask[i-1,j]
+            if row[j] < fillthreshold:
+                a = row[j-1]
+                b = above[j]
                 if a == b:
-                    mask[i,j] = a
+                    row[j] = a
                 elif b > 0:
-                    mask[i,j] = b
+                    row[j] = b
                 else:
-                    mask[i,j] = a           
+                    row[j] = a
+
+_fillinzeros_jit = None
+
+def fillinzeros_kernel():
+    """numba-compiled fillinzeros loop, or None if numba is not installed.
+    numba is imported (and the kernel compiled) on first use only."""
+    global _fillinzeros_jit
+    if _fillinzeros_jit is None:
+        try:
+            import numba
+        except ImportError:
+            _fillinzeros_jit = False
+        else:
+            _fillinzeros_jit = numba.njit(cache=True)(_fillinzeros_loop)
+    return _fillinzeros_jit or None
+
+def fillinzeros(mask, fillthreshold=1, use_jit=True):
+    """Fill cells below fillthreshold from their left/upper neighbors, in place.
+    Fills propagate in row-major order and wrap at the array edges. Uses a
+    compiled kernel when numba is installed, otherwise pure Python."""
+    if mask.size == 0:
+        return mask
+    kernel = fillinzeros_kernel() if use_jit else None
+    if kernel is not None and mask.dtype.kind in 'biuf':
+        kernel(mask, fillthreshold)
+    else:
+        rows = mask.tolist()
+        _fillinzeros_rows(rows, fillthreshold)
+        mask[...] = rows
 
     return mask
 
+def _window_sums(grid, periodic=False):
+    """Sum over each cell's 3x3 window; cells beyond the edges count as 0.
+    With periodic=True the longitude (last) axis wraps around."""
+    rows = grid.copy()
+    rows[1:] += grid[:-1]
+    rows[:-1] += grid[1:]
+    sums = rows.copy()
+    sums[:,1:] += rows[:,:-1]
+    sums[:,:-1] += rows[:,1:]
+    if periodic:
+        sums[:,0] += rows[:,-1]
+        sums[:,-1] += rows[:,0]
+    return sums
+
+def _nan_window_mean(grid, periodic=False):
+    """NaN-ignoring 3x3 window mean and the number of finite cells per window."""
+    gaps = np.isnan(grid)
+    sums = _window_sums(np.where(gaps, 0., grid), periodic)
+    counts = _window_sums((~gaps).astype(float), periodic)
+    means = np.divide(sums, counts, out=np.full(grid.shape, np.nan), where=counts>0)
+    return means, counts
+
 def fill_nearest(grid):
+    """Replace NaN interior cells by the nanmean of their 3x3 window (one pass).
+    The outer border is set to 0, as in the original analysis."""
+    grid = np.asarray(grid, dtype=float)
+    means, _ = _nan_window_mean(grid)
     out = np.zeros_like(grid)
-    ny,nx = grid.shape
-    for j in range(1,ny-1):
-        for i in range(1,nx-1):
-            if np.isnan(grid[j,i]):
-                out[j,i] = np.nanmean(grid[j-1:j+2,i-1:i+2])
-            else:
-                out[j,i] = grid[j,i]
-    return out 
+    out[1:-1,1:-1] = np.where(np.isnan(grid), means, grid)[1:-1,1:-1]
+    return out
+
+_neighbour_rows = np.array([-1,-1,-1,0,0,1,1,1])[:,None]
+_neighbour_cols = np.array([-1,0,1,-1,1,-1,0,1])[:,None]
+
+def _neighbour_index(flat, shape, periodic=False):
+    """Flat indices of the 8 neighbors of flat cell indices, shape (8, n);
+    -1 beyond the edges. With periodic=True the longitude (last) axis wraps."""
+    ny, nx = shape
+    r, c = np.divmod(flat, nx)
+    nr, nc = r + _neighbour_rows, c + _neighbour_cols
+    if periodic:
+        nc %= nx
+    valid = (nr >= 0) & (nr < ny) & (nc >= 0) & (nc < nx)
+    return np.where(valid, nr*nx + nc, -1)
+
+def fill_gaps(grid, periodic=True, maxiter=1000):
+    """Fill NaN cells with the mean of their finite 3x3 neighbors, repeatedly.
+    Each pass fills the cells bordering data, so gaps close from their edges
+    inward until none are left, no cell can be filled or maxiter is reached.
+    Longitude wraps around the dateline when periodic; borders are kept.
+    Only the gap frontier is visited: after the first pass, the cells to fill
+    are the still-empty neighbors of the cells filled in the previous pass."""
+    filled = np.array(grid, dtype=float)
+    flat = filled.reshape(-1)
+    padded = np.empty(flat.size + 1)  # index -1 (beyond the edges) reads NaN
+    padded[-1] = np.nan
+    front = np.flatnonzero(np.isnan(flat))
+    for _ in range(maxiter):
+        if not front.size:
+            break
+        neighbours = _neighbour_index(front, filled.shape, periodic)
+        padded[:-1] = flat
+        values = padded[neighbours]
+        finite = ~np.isnan(values)
+        counts = finite.sum(axis=0)
+        fill = counts > 0
+        if not fill.any():
+            break
+        front = front[fill]
+        flat[front] = np.where(finite, values, 0.).sum(axis=0)[fill]/counts[fill]
+        nxt = neighbours[:,fill].ravel()
+        nxt = np.sort(nxt[nxt >= 0])
+        nxt = nxt[np.isnan(flat[nxt])]
+        front = nxt[np.append(nxt[:1] >= 0, nxt[1:] != nxt[:-1])]
+    return filled
 
 def gridbox_areas(lats,lons):
     areas = np.ones((len(lats),len(lons)))
@@ -626,3 +1441,105 @@ def gridbox_areas(lats,lons):
     areas = areas*np.cos(lats*np.pi/180)[:,None]
     return areas
 
+
+# Multi-year catch time series
+_cell_lookups = {}
+
+def cell_index_lookup(cellx=720,celly=360):
+    """catch_cell_index of every valid CellID as one array, indexed by
+    CellID+1 (computed once per grid size and reused)."""
+    if (cellx,celly) not in _cell_lookups:
+        _cell_lookups[cellx,celly] = catch_cell_index(np.arange(-1, cellx*celly-1), cellx, celly)
+    return _cell_lookups[cellx,celly]
+
+def _iter_years(catchdata, yearheader):
+    """(year, table or CSV path) pairs from a dict, a table with a year
+    column or an iterable of pairs."""
+    if isinstance(catchdata, dict):
+        return ((y, catchdata[y]) for y in sorted(catchdata))
+    if isinstance(catchdata, pd.DataFrame):
+        return iter(catchdata.groupby(yearheader, sort=True))
+    return iter(catchdata)
+
+def grid_catch_year(catchdata, categories, cellx=720, celly=360, regionheader='Reg',
+                    regions=None):
+    """(category, lat, lon) catch of one year summed over regions (or only
+    the given ones), from a table or a CSV path streamed in chunks."""
+    lookup = cell_index_lookup(cellx, celly)
+    ncells = cellx*celly
+    chunks = (read_catch_chunks(catchdata, regionheader=regionheader)
+              if isinstance(catchdata, (str, os.PathLike)) else [catchdata])
+    total = np.zeros(len(categories)*ncells)
+    for chunk in chunks:
+        codes = pd.Categorical(chunk['Hg_category'].values, categories=categories).codes
+        keep = codes >= 0
+        if regions is not None:
+            keep &= np.isin(chunk[regionheader].values, regions)
+        cellids = chunk['CellID'].values[keep].astype(np.int64) + 1
+        if cellids.size and (cellids.min() < 0 or cellids.max() >= ncells):
+            raise ValueError(f'CellID outside of grid with {ncells} cells')
+        flat = codes[keep].astype(np.int64)*ncells + lookup[cellids]
+        total += np.bincount(flat, weights=chunk['Catch'].values[keep].astype(float),
+                             minlength=total.size)
+    return total.reshape(len(categories), celly, cellx)
+
+def hg_time_series(catchdata, swdata_stack, eez_ids, fishes=None, yearheader='Year',
+                   rollup=None, out=None, cellx=720, celly=360, **gridargs):
+    """Yearly Hg maps and EEZ/country tables from multi-year catch records.
+    catchdata is a dict {year: table or CSV path}, a table with a yearheader
+    column or an iterable of (year, table) pairs; years are gridded and
+    mapped one at a time (grid_catch_year, map_hg_all), so only one year of
+    catch and maps is held in memory. The seawater stack (category, lat, lon)
+    ordered as fishes, the cell-index lookup, the EEZ membership matrix and
+    the country rollup are set up once and shared by all years. If given,
+    out, e.g. an np.lib.format.open_memmap of shape (year, category, lat,
+    lon), receives the mid Hg maps. Returns a dict with 'years' and
+    DataFrames 'eez' and 'country' (catch-weighted mean Hg, rows (year,
+    EEZ/country), columns (category, band)) and 'eez_catch'."""
+    fishes = names if fishes is None else list(fishes)
+    categories = [species_names_r[f] for f in fishes]
+    sw = np.asarray(swdata_stack, dtype=float)
+    ids, member, _ = eez_membership(eez_ids)
+    rollup = build_country_rollup(ids, warn=False) if rollup is None else rollup
+    bands = ['mid', 'low', 'high']
+    years, eezmeans, countrymeans, catches = [], [], [], []
+    for i, (year, table) in enumerate(_iter_years(catchdata, yearheader)):
+        catch = grid_catch_year(table, categories, cellx, celly, **gridargs)
+        mid, low, high = map_hg_all(sw, catch, fishes)
+        if out is not None:
+            out[i] = mid
+        maps = np.stack([mid, low, high], axis=1).reshape(-1, member.shape[0])
+        weighted = np.nan_to_num(maps*np.repeat(catch.reshape(len(fishes), -1), 3, axis=0))
+        total = np.asarray(catch.reshape(len(fishes), -1) @ member)
+        wsum = np.asarray(weighted @ member).reshape(len(fishes), 3, len(ids))
+        mean = np.divide(wsum, total[:,None], out=np.full(wsum.shape, np.nan),
+                         where=total[:,None]>0)
+        years.append(year)
+        catches.append(total)
+        eezmeans.append(mean)
+        countrymeans.append(rollup.mean(mean, total[:,None], ids=ids))
+
+    columns = pd.MultiIndex.from_product([fishes, bands], names=['category', 'band'])
+    def frame(values, labels, name):
+        values = np.array(values)  # (year, category, band, label)
+        index = pd.MultiIndex.from_product([years, labels], names=['year', name])
+        return pd.DataFrame(values.transpose(0, 3, 1, 2).reshape(len(index), -1),
+                            index=index, columns=columns)
+    eezlabels = [eezindex_to_label[i] for i in ids]
+    eez_catch = pd.DataFrame(np.array(catches).transpose(0, 2, 1).reshape(-1, len(fishes)),
+                             index=pd.MultiIndex.from_product([years, eezlabels],
+                                                              names=['year', 'EEZ']),
+                             columns=pd.Index(fishes, name='category'))
+    return {'years': years, 'eez': frame(eezmeans, eezlabels, 'EEZ'),
+            'country': frame(countrymeans, rollup.countries, 'country'),
+            'eez_catch': eez_catch}
+
+# Stages recorded by hgprofile while profiling is enabled
+profiled_stages = ['calc_scaling', 'get_catch_limits', 'map_hg_for_fish', 'stack_categories',
+                   'map_hg_all', 'draw_params', 'montecarlo_hg', 'aggregate_eez',
+                   'build_country_rollup', 'bin_catch', 'grid_species_catch',
+                   'build_catch_cube', 'read_catch', 'build_catch_cube_chunked',
+                   'regrid_refine', 'regrid_down', 'regrid_lon_25_2', 'remap_weights',
+                   'apply_remap', 'regrid_conservative', 'fillinzeros', 'fill_nearest',
+                   'fill_gaps', 'gridbox_areas', 'grid_catch_year', 'hg_time_series']
+hgprofile.instrument_module(globals(), profiled_stages, 'catchtools')
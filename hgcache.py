@@ -0,0 +1,247 @@
+import functools
+import glob
+import hashlib
+import inspect
+import os
+import tempfile
+import weakref
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+
+import catchtools as ct
+
+
+_table_digests = {}  # id(table) -> (weakref, cheap signature, digest)
+
+
+def _table_signature(obj):
+    if isinstance(obj, pd.Series):
+        return (obj.shape, (str(obj.name),), (str(obj.dtype),))
+    return (obj.shape, tuple(str(c) for c in obj.columns), tuple(str(d) for d in obj.dtypes))
+
+
+def table_digest(obj):
+    """Content hash of a DataFrame or Series, computed once per object.
+    The digest is memoized by object identity and reused while the object
+    is alive and keeps its shape, labels and dtypes, so tables must not be
+    edited in place between cached calls (pass a modified copy instead)."""
+    signature = _table_signature(obj)
+    entry = _table_digests.get(id(obj))
+    if entry is not None and entry[0]() is obj and entry[1] == signature:
+        return entry[2]
+    h = hashlib.sha1(repr(signature).encode())
+    h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    digest = h.digest()
+    _table_digests[id(obj)] = (weakref.ref(obj), signature, digest)
+    weakref.finalize(obj, _table_digests.pop, id(obj), None)
+    return digest
+
+
+def _hash_update(h, obj):
+    """Feed obj into hash h; arrays are hashed by dtype, shape and content."""
+    if isinstance(obj, ct.SparseGrid):
+        h.update(b'sparse')
+        _hash_update(h, obj.shape)
+        m = obj.matrix
+        for part in (m.data, m.indices, m.indptr):
+            _hash_update(h, part)
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        h.update(b'pandas')
+        h.update(table_digest(obj))
+    elif isinstance(obj, np.ndarray) or isinstance(obj, np.generic):
+        arr = np.ascontiguousarray(obj)
+        h.update(f'array{arr.dtype.str}{arr.shape}'.encode())
+        if arr.dtype.hasobject:
+            h.update(repr(arr.tolist()).encode())
+        else:
+            h.update(arr.tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'dict')
+        for key in sorted(obj, key=repr):
+            _hash_update(h, key)
+            _hash_update(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'{type(obj).__name__}{len(obj)}'.encode())
+        for item in obj:
+            _hash_update(h, item)
+    else:
+        h.update(f'{type(obj).__name__}:{obj!r}'.encode())
+
+
+def _encode(value):
+    """Flatten a stage result into arrays for np.savez."""
+    single = not isinstance(value, tuple)
+    items = (value,) if single else value
+    arrays, kinds = {}, []
+    for i, item in enumerate(items):
+        if isinstance(item, ct.SparseGrid):
+            kinds.append('sparse')
+            m = item.matrix
+            arrays.update({f'{i}_data': m.data, f'{i}_indices': m.indices,
+                           f'{i}_indptr': m.indptr, f'{i}_shape': np.array(item.shape)})
+        else:
+            kinds.append('list' if isinstance(item, list) else 'array')
+            arr = np.asarray(item)
+            if arr.dtype.hasobject:  # e.g. string labels; keeps the file pickle-free
+                arr = arr.astype(str)
+            arrays[f'{i}'] = arr
+    arrays['__kinds__'] = np.array(kinds)
+    arrays['__single__'] = np.array(single)
+    return arrays
+
+
+def _decode(npz):
+    items = []
+    for i, kind in enumerate(npz['__kinds__']):
+        if kind == 'sparse':
+            shape = tuple(int(x) for x in npz[f'{i}_shape'])
+            nrows = int(np.prod(shape[:-2], dtype=np.int64))
+            matrix = sps.csr_matrix((npz[f'{i}_data'], npz[f'{i}_indices'], npz[f'{i}_indptr']),
+                                    shape=(nrows, shape[-2]*shape[-1]))
+            items.append(ct.SparseGrid(matrix, shape))
+        elif kind == 'list':
+            items.append(npz[f'{i}'].tolist())
+        else:
+            items.append(npz[f'{i}'])
+    return items[0] if npz['__single__'] else tuple(items)
+
+
+def code_version(func):
+    """Short hash of func's source (bytecode if the source is unavailable)."""
+    func = inspect.unwrap(func)  # past hgprofile instrumentation
+    try:
+        code = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = func.__code__.co_code
+    return hashlib.sha1(code).hexdigest()[:12]
+
+
+class StageCache:
+    """Content-addressed cache of pipeline results as compressed .npz files.
+    Entries are keyed on a hash of the stage name and its inputs, and the
+    least recently used entries are evicted once the cache exceeds maxbytes."""
+
+    def __init__(self, cachedir, maxbytes=2**30):
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+        os.makedirs(cachedir, exist_ok=True)
+
+    def key(self, stage, *parts, version=''):
+        h = hashlib.sha1(f'{stage}:{version}'.encode())
+        _hash_update(h, parts)
+        return f'{stage}-{h.hexdigest()}'
+
+    def path(self, key):
+        return os.path.join(self.cachedir, f'{key}.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def load(self, key):
+        """Cached value for key; raises KeyError if missing. Entries that
+        cannot be read are deleted and treated as missing."""
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                value = _decode(npz)
+        except FileNotFoundError:
+            raise KeyError(key)
+        except Exception:
+            self.invalidate(key=key)
+            raise KeyError(key)
+        os.utime(path)  # mark as recently used
+        return value
+
+    def save(self, key, value):
+        fd, tmp = tempfile.mkstemp(suffix='.npz', dir=self.cachedir)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **_encode(value))
+        os.replace(tmp, self.path(key))
+        self.evict()
+
+    def entries(self):
+        return glob.glob(os.path.join(self.cachedir, '*.npz'))
+
+    def size(self):
+        return sum(os.path.getsize(p) for p in self.entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in maxbytes."""
+        entries = [(os.stat(p), p) for p in self.entries()]
+        total = sum(st.st_size for st, _ in entries)
+        for st, p in sorted(entries, key=lambda e: e[0].st_mtime):
+            if total <= self.maxbytes:
+                break
+            os.remove(p)
+            total -= st.st_size
+
+    def invalidate(self, stage=None, key=None):
+        """Remove one entry (key), all entries of a stage, or everything."""
+        if key is not None:
+            paths = [self.path(key)]
+        elif stage is not None:
+            paths = glob.glob(os.path.join(self.cachedir, f'{glob.escape(stage)}-*.npz'))
+        else:
+            paths = self.entries()
+        for p in paths:
+            if os.path.exists(p):
+                os.remove(p)
+
+    def wrap(self, func, stage=None, keyparts=None, version=None):
+        """Cached version of func. keyparts(*args, **kwargs) returns what the
+        key is built from (default: all arguments), or None to bypass the cache.
+        version tags the keys with the stage's code (default: a hash of func's
+        source, so editing func invalidates its entries; pass an explicit
+        version to also cover changes in the helpers it calls)."""
+        stage = func.__name__ if stage is None else stage
+        version = code_version(func) if version is None else version
+
+        @functools.wraps(func)
+        def cached(*args, **kwargs):
+            parts = (args, kwargs) if keyparts is None else keyparts(*args, **kwargs)
+            if parts is None:
+                return func(*args, **kwargs)
+            key = self.key(stage, parts, version=version)
+            try:
+                return self.load(key)
+            except KeyError:
+                value = func(*args, **kwargs)
+                self.save(key, value)
+                return value
+        return cached
+
+
+def fish_param_values(fish):
+    """Current catchtools parameters a category's Hg map depends on, by name."""
+    return {'hgstats': tuple(ct.hgstats[fish]), 'scale_lower': ct.scale_lower.get(fish, 1.0),
+            'scale_upper': ct.scale_upper.get(fish, 1.0),
+            'depth': ct.depth_choices[ct.names.index(fish)]}
+
+
+def _map_hg_for_fish_key(fish, swdata, category_catch):
+    return (fish, swdata[fish], category_catch[ct.species_names_r[fish]],
+            fish_param_values(fish))
+
+
+def _map_hg_all_key(swdata_stack, catch_stack, fishes=None, diagnostics=None):
+    if diagnostics is not None:
+        return None
+    fishes = ct.names if fishes is None else fishes
+    return (swdata_stack, catch_stack, [(f, fish_param_values(f)) for f in fishes])
+
+
+def cached_stages(cachedir, maxbytes=2**30):
+    """Cached versions of the catchtools pipeline stages sharing one StageCache.
+    Returns a namespace with the wrapped functions and the cache itself
+    (for invalidate/evict). Catch tables are hashed once per object (see
+    table_digest), so repeated calls on the same table only cost a lookup."""
+    cache = StageCache(cachedir, maxbytes)
+    stages = {name: cache.wrap(getattr(ct, name)) for name in
+              ['grid_species_catch', 'build_catch_cube', 'regrid_down', 'regrid_refine',
+               'regrid_lon_25_2', 'regrid_conservative', 'fill_nearest', 'fill_gaps']}
+    stages['map_hg_for_fish'] = cache.wrap(ct.map_hg_for_fish, keyparts=_map_hg_for_fish_key)
+    stages['map_hg_all'] = cache.wrap(ct.map_hg_all, keyparts=_map_hg_all_key)
+    return SimpleNamespace(cache=cache, **stages)
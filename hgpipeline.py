@@ -0,0 +1,112 @@
+"""Incremental recomputation of the per-category Hg maps and EEZ/country
+tables after edits of the catchtools parameters or of a category's catch.
+
+    pipeline = hgpipeline.IncrementalPipeline(seawater, category_catch, eez_ids)
+    catchtools.scale_upper['High'] = 1.4
+    pipeline.update()  # {'High': ['high']}
+"""
+import numpy as np
+import pandas as pd
+
+import catchtools as ct
+from hgcache import fish_param_values
+
+
+# Parameters each Hg band of a category is derived from (besides its catch)
+band_dependencies = {'mid': {'hgstats', 'depth'},
+                     'low': {'hgstats', 'depth', 'scale_lower'},
+                     'high': {'hgstats', 'depth', 'scale_upper'}}
+bound_params = {'low': 'scale_lower', 'high': 'scale_upper'}
+
+
+class IncrementalPipeline:
+    """Hg maps and EEZ/country tables of all categories, kept up to date per
+    category. update() compares each category's parameters (hgstats,
+    scale_lower/upper, depth_choices) and catch with those its outputs were
+    built from, recomputes only the affected bands (band_dependencies) and
+    patches their columns of eez_table and country_table in place.
+    seawater is a dict of fields by category, or a function (fish, depth)
+    returning the field for a depth range, which depth_choices edits need.
+    category_catch is keyed by catch label as for map_hg_for_fish."""
+
+    def __init__(self, seawater, category_catch, eez_ids, fishes=None, rollup=None):
+        self.seawater = seawater
+        self.catch = dict(category_catch)
+        self.fishes = list(ct.names if fishes is None else fishes)
+        self.ids, self._member, _ = ct.eez_membership(eez_ids)
+        self.rollup = ct.build_country_rollup(self.ids, warn=False) if rollup is None else rollup
+        eez = pd.Index([ct.eezindex_to_label[i] for i in self.ids], name='EEZ')
+        columns = pd.MultiIndex.from_product([self.fishes, list(band_dependencies)],
+                                             names=['category', 'band'])
+        self.maps = {}
+        self.built = {}  # parameters (and catch) each category's outputs came from
+        self.eez_catch = pd.DataFrame(np.nan, index=eez, columns=self.fishes)
+        self.eez_table = pd.DataFrame(np.nan, index=eez, columns=columns)
+        self.country_table = pd.DataFrame(
+            np.nan, index=pd.Index(self.rollup.countries, name='country'), columns=columns)
+        self.update()
+
+    def set_catch(self, fish, catch):
+        """Replace a category's catch grid; all its outputs become stale."""
+        self.catch[ct.species_names_r[fish]] = catch
+        self.built.pop(fish, None)
+
+    def stale(self):
+        """{category: changed parameter names} for outdated categories
+        ('catch' if the category was never built or its catch changed)."""
+        changed = {}
+        for fish in self.fishes:
+            if fish not in self.built:
+                changed[fish] = {'catch'}
+                continue
+            now = fish_param_values(fish)
+            diff = {k for k, v in now.items() if self.built[fish][k] != v}
+            if diff:
+                changed[fish] = diff
+        return changed
+
+    def _eez_sum(self, stack):
+        flat = np.nan_to_num(stack).reshape(-1, self._member.shape[0])
+        return np.asarray(flat @ self._member)
+
+    def update(self):
+        """Recompute what the parameter edits since the last update affect.
+        Returns {category: recomputed bands}. Raises ValueError, before
+        changing anything, if a depth_choices edit needs a seawater field
+        that a plain dict of fields cannot provide."""
+        stale = self.stale()
+        if not callable(self.seawater):
+            redepth = [fish for fish, changed in stale.items() if 'depth' in changed]
+            if redepth:
+                raise ValueError(f'depth_choices changed for {redepth}, but seawater is a '
+                                 'dict of fixed fields; pass a function (fish, depth)')
+        done = {}
+        for fish, changed in stale.items():
+            params = fish_param_values(fish)
+            bands = [b for b, deps in band_dependencies.items()
+                     if 'catch' in changed or deps & changed]
+            catch = self.catch[ct.species_names_r[fish]]
+            if hasattr(catch, 'todense'):  # e.g. catchtools.SparseGrid
+                catch = np.asarray(catch.todense())
+            if 'mid' in bands:
+                sw = (self.seawater(fish, params['depth']) if callable(self.seawater)
+                      else self.seawater[fish])
+                mid, low, high = ct.map_hg_for_fish(fish, {fish: sw}, self.catch)
+                self.maps[fish] = {'mid': mid, 'low': low, 'high': high}
+            else:  # only a regression bound scaling changed
+                mid = self.maps[fish]['mid']
+                for band in bands:
+                    self.maps[fish][band] = mid*params[bound_params[band]]
+            if 'catch' in changed:
+                self.eez_catch[fish] = self._eez_sum(catch)[0]
+            total = self.eez_catch[fish].to_numpy()
+            wsum = self._eez_sum(np.stack([self.maps[fish][b]*catch for b in bands]))
+            means = np.divide(wsum, total, out=np.full(wsum.shape, np.nan), where=total > 0)
+            countries = self.rollup.mean(means, total, ids=self.ids)
+            for band, eezmean, countrymean in zip(bands, means, countries):
+                self.eez_table[(fish, band)] = eezmean
+                self.country_table[(fish, band)] = countrymean
+            self.built[fish] = params
+            done[fish] = bands
+        return done
+
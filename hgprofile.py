@@ -0,0 +1,233 @@
+"""Opt-in timing instrumentation of the catchtools and plottools.maps stages.
+
+Enable it for a block of code:
+
+    with hgprofile.profile(trace='run_trace.json', memory=True) as prof:
+        ...
+    print(prof.table())
+
+or for a whole run with the HGPROFILE environment variable: HGPROFILE=1
+prints the table to stderr at exit, any other value is used as the path of
+the Chrome trace-event JSON (open in chrome://tracing or Perfetto).
+HGPROFILE_MEMORY=1 also traces allocation peaks. Instrumented functions
+cost one flag check per call while profiling is off.
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+_active = None  # the running Profile, if any
+_local = threading.local()
+
+
+def _nbytes(obj):
+    """Size of array-like obj in bytes (0 for anything else)."""
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if hasattr(obj, 'memory_usage'):  # pandas.DataFrame
+        return int(obj.memory_usage(deep=False).sum())
+    if isinstance(obj, (tuple, list)):
+        return sum(_nbytes(o) for o in obj)
+    if isinstance(obj, dict):
+        return sum(_nbytes(o) for o in obj.values())
+    return 0
+
+
+class Profile:
+    """Spans recorded while profiling: one dict per instrumented call with
+    name, category, start/duration (s), depth, bytes in/out, the largest
+    input shape, the allocation peak (with memory=True) and annotations."""
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.owns_tracemalloc = False
+        self.spans = []
+        self.t0 = time.perf_counter()
+
+    def _enter(self, name, category, args):
+        stack = _stack()
+        span = {'name': name, 'cat': category, 'depth': len(stack),
+                'tid': threading.get_ident(), 'in_bytes': 0, 'args': {}}
+        arrays = [a for a in args if hasattr(a, 'shape')]
+        if arrays:
+            largest = max(arrays, key=_nbytes)
+            span['shape'] = list(largest.shape)
+        span['in_bytes'] = _nbytes(args)
+        if self.memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+            tracemalloc.reset_peak()
+            span['_base'] = span['_peak'] = current
+        stack.append(span)
+        span['start'] = time.perf_counter() - self.t0
+        return span
+
+    def _exit(self, span, result):
+        span['dur'] = time.perf_counter() - self.t0 - span['start']
+        stack = _stack()
+        stack.pop()
+        span['out_bytes'] = _nbytes(result)
+        if stack:
+            stack[-1]['child'] = stack[-1].get('child', 0.) + span['dur']
+        if self.memory:
+            import tracemalloc
+            peak = max(span.pop('_peak'), tracemalloc.get_traced_memory()[1])
+            span['peak_bytes'] = peak - span.pop('_base')
+            if stack:
+                stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+            tracemalloc.reset_peak()
+        self.spans.append(span)
+
+    def summary(self):
+        """Per-function totals: calls, total/self/max time, peak and bytes."""
+        rows = {}
+        for s in self.spans:
+            r = rows.setdefault(s['name'], {'name': s['name'], 'cat': s['cat'], 'calls': 0,
+                                            'total': 0., 'self': 0., 'max': 0.,
+                                            'peak_bytes': 0, 'in_bytes': 0})
+            r['calls'] += 1
+            r['total'] += s['dur']
+            r['max'] = max(r['max'], s['dur'])
+            r['peak_bytes'] = max(r['peak_bytes'], s.get('peak_bytes', 0))
+            r['in_bytes'] = max(r['in_bytes'], s['in_bytes'])
+            r['self'] += s['dur'] - s.get('child', 0.)
+        return sorted(rows.values(), key=lambda r: -r['self'])
+
+    def table(self):
+        """Flat text table of summary(), most expensive (self time) first."""
+        lines = [f"{'function':<32} {'calls':>6} {'total (s)':>10} {'self (s)':>10} "
+                 f"{'max (s)':>9} {'peak (MB)':>10} {'in (MB)':>9}"]
+        for r in self.summary():
+            peak = f"{r['peak_bytes']/2**20:10.1f}" if self.memory else f"{'-':>10}"
+            lines.append(f"{r['cat'] + '.' + r['name']:<32} {r['calls']:6d} {r['total']:10.4f} "
+                         f"{r['self']:10.4f} {r['max']:9.4f} {peak} {r['in_bytes']/2**20:9.1f}")
+        return '\n'.join(lines)
+
+    def trace_events(self):
+        """Spans as Chrome trace-event 'complete' events (times in us)."""
+        pid = os.getpid()
+        events = []
+        for s in self.spans:
+            args = dict(s['args'], in_bytes=s['in_bytes'], out_bytes=s['out_bytes'])
+            for key in ('shape', 'peak_bytes'):
+                if key in s:
+                    args[key] = s[key]
+            events.append({'name': s['name'], 'cat': s['cat'], 'ph': 'X', 'pid': pid,
+                           'tid': s['tid'], 'ts': s['start']*1e6, 'dur': s['dur']*1e6,
+                           'args': args})
+        return events
+
+    def write_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f,
+                      default=str)
+        return path
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def instrument(func, category=None):
+    """Wrap func so its calls are recorded while profiling is on."""
+    category = func.__module__ if category is None else category
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        prof = _active
+        if prof is None:
+            return func(*args, **kwargs)
+        span = prof._enter(name, category, args + tuple(kwargs.values()))
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            prof._exit(span, result)
+    return wrapper
+
+
+def instrument_module(namespace, names, category):
+    """Instrument the named functions of a module namespace (its globals())
+    in place, so calls between them are recorded as nested spans."""
+    for name in names:
+        namespace[name] = instrument(namespace[name], category)
+
+
+def annotate(**values):
+    """Attach values (e.g. diagnostics) to the innermost recorded call."""
+    if _active is not None:
+        stack = _stack()
+        if stack:
+            stack[-1]['args'].update(values)
+
+
+def enabled():
+    return _active is not None
+
+
+def start(memory=False):
+    """Start recording into a new Profile and return it."""
+    global _active
+    prof = Profile(memory)
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            prof.owns_tracemalloc = True
+    _active = prof
+    return prof
+
+
+def stop():
+    """Stop recording and return the finished Profile."""
+    global _active
+    prof, _active = _active, None
+    if prof is not None and prof.owns_tracemalloc:
+        import tracemalloc
+        tracemalloc.stop()
+    return prof
+
+
+class profile:
+    """Context manager recording a Profile; optionally writes the Chrome
+    trace to trace and prints the table (to report, a file object) on exit."""
+
+    def __init__(self, trace=None, memory=False, report=None):
+        self.trace = trace
+        self.memory = memory
+        self.report = report
+
+    def __enter__(self):
+        return start(self.memory)
+
+    def __exit__(self, *exc):
+        prof = stop()
+        if self.trace is not None:
+            prof.write_trace(self.trace)
+        if self.report is not None:
+            print(prof.table(), file=self.report)
+        return False
+
+
+def _report_at_exit(target):
+    prof = stop()
+    if prof is None:
+        return
+    print(prof.table(), file=sys.stderr)
+    if target not in ('1', 'true', 'yes'):
+        print(f'trace written to {prof.write_trace(target)}', file=sys.stderr)
+
+
+if os.environ.get('HGPROFILE') and _active is None:
+    start(memory=os.environ.get('HGPROFILE_MEMORY', '') not in ('', '0'))
+    atexit.register(_report_at_exit, os.environ['HGPROFILE'])
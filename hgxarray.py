@@ -0,0 +1,162 @@
+"""Labeled, dask-chunked version of the catchtools Hg mapping pipeline.
+
+Catch cubes, seawater Hg fields and Hg maps are xarray DataArrays with
+dims among (category, region, year, lat, lon); category labels are the
+display names of catchtools.names. Everything stays lazy until computed,
+and dask evaluates one chunk at a time in parallel, so memory is bounded
+by the chunk size rather than the number of years or categories. The
+reductions run over whole lat/lon planes, so chunks are split along the
+other dims only (inputs chunked along lat/lon are rechunked).
+"""
+import os
+
+import dask
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+import catchtools as ct
+
+spatial_dims = ('lat', 'lon')
+
+
+def grid_coords(cellx=720, celly=360):
+    """(lats, lons) cell centres of the catch grid; rows run south from 90N
+    and columns east from 180W."""
+    dlat, dlon = 180/celly, 360/cellx
+    return (90 - dlat*(np.arange(celly) + 0.5), -180 + dlon*(np.arange(cellx) + 0.5))
+
+
+def _whole_planes(x):
+    if x.chunks is not None and any(d in x.dims for d in spatial_dims):
+        x = x.chunk({d: -1 for d in spatial_dims if d in x.dims})
+    return x
+
+
+def category_params(fishes=None):
+    """catchtools.category_params as DataArrays along category."""
+    fishes = ct.names if fishes is None else list(fishes)
+    return {key: xr.DataArray(val, dims='category', coords={'category': fishes})
+            for key, val in ct.category_params(fishes).items()}
+
+
+def _catch_block(catchdata, regionheader, category, regions, cellx, celly, sum_regions):
+    if isinstance(catchdata, (str, os.PathLike)):  # stream the CSV in chunks
+        chunks = ct.read_catch_chunks(catchdata, regionheader=regionheader)
+        cube, _, _ = ct.build_catch_cube_chunked(chunks, regionheader, [category], regions,
+                                                 cellx, celly)
+    else:
+        cube, _, _ = ct.build_catch_cube(catchdata, regionheader, [category], regions,
+                                         cellx, celly)
+    return cube.sum(axis=1) if sum_regions else cube
+
+
+def catch_dataarray(catchdata, regions, fishes=None, regionheader='Reg',
+                    cellx=720, celly=360, sum_regions=False):
+    """Catch cube as a lazy DataArray (category, region, [year,] lat, lon).
+    catchdata is a catch table, or a dict {year: table or CSV path} for a
+    year dim. There is one block per category (and year), gridded with
+    build_catch_cube only when it is computed, so at most one category's
+    (region, lat, lon) cube is held per task; CSV paths are streamed through
+    read_catch_chunks once per block. With sum_regions the region dim is
+    summed inside each block, giving (category, [year,] lat, lon). regions
+    must be given since the blocks are built independently."""
+    fishes = ct.names if fishes is None else list(fishes)
+    regions = np.asarray(regions)
+    lats, lons = grid_coords(cellx, celly)
+    shape = ((1,) if sum_regions else (1, len(regions))) + (celly, cellx)
+    coords = {'category': fishes, 'lat': lats, 'lon': lons}
+    dims = ('category',) if sum_regions else ('category', 'region')
+    if not sum_regions:
+        coords['region'] = regions
+
+    def block(table):
+        blocks = [da.from_delayed(dask.delayed(_catch_block)(
+                      table, regionheader, ct.species_names_r[f], regions, cellx, celly,
+                      sum_regions), shape, dtype=float)
+                  for f in fishes]
+        return da.concatenate(blocks, axis=0)
+
+    if not isinstance(catchdata, dict):
+        return xr.DataArray(block(catchdata), dims=dims + spatial_dims,
+                            coords=coords, name='catch')
+    years = sorted(catchdata)
+    data = da.stack([block(catchdata[y]) for y in years], axis=len(dims))
+    return xr.DataArray(data, dims=dims + ('year',) + spatial_dims,
+                        coords=dict(coords, year=years), name='catch')
+
+
+def seawater_dataarray(swdata, fishes=None, years=None, lats=None, lons=None):
+    """Seawater Hg fields (dict by category, as for map_hg_for_fish) as a
+    DataArray (category, [year,] lat, lon) chunked per category (and year).
+    With years, each field is a (year, lat, lon) array. lats/lons default to
+    the grid_coords of the field shape."""
+    fishes = ct.names if fishes is None else list(fishes)
+    data = da.stack([da.asarray(swdata[f]) for f in fishes])
+    dims = ('category',) + (() if years is None else ('year',)) + spatial_dims
+    if lats is None:
+        lats, lons = grid_coords(data.shape[-1], data.shape[-2])
+    coords = {'category': fishes, 'lat': lats, 'lon': lons}
+    if years is not None:
+        coords['year'] = list(years)
+    chunks = (1,)*(len(dims) - 2) + (-1, -1)
+    return xr.DataArray(data.rechunk(chunks), dims=dims, coords=coords, name='seawater_hg')
+
+
+def catch_weighted_mean(field, catch, dims=spatial_dims):
+    """Catch-weighted mean of field over dims, ignoring NaNs."""
+    return (field*catch).sum(dims)/catch.sum(dims)
+
+
+def scaling(hg, catch):
+    """Normalized scaling factor (as catchtools.calc_scaling)."""
+    return hg/catch_weighted_mean(hg, catch)
+
+
+def map_hg(swdata, catch, fishes=None):
+    """Lazy map_hg_all on labeled data. swdata and catch have a category dim
+    (display names) and may carry year; catch is summed over region if
+    present. Seawater fields without a year dim are reused for every catch
+    year. Returns a Dataset with the mid, low and high Hg maps."""
+    fishes = list(swdata['category'].values) if fishes is None else list(fishes)
+    if 'region' in catch.dims:
+        catch = catch.sum('region')
+    sw = _whole_planes(swdata.sel(category=fishes)).astype(float)
+    catch = _whole_planes(catch.sel(category=fishes))
+    sw, catch = xr.align(sw, catch, join='exact')
+    p = category_params(fishes)
+
+    wherecatch = (catch > 0) & (sw > 0)
+    mmax = sw.where(wherecatch).max(spatial_dims)
+    # make max:min ratio equal empirical, then scale to empirical mean
+    prescl = sw*(p['max'] - p['min'])/mmax + p['min']
+    mid = (scaling(prescl, catch)*p['mean']).transpose(..., *spatial_dims)
+    return xr.Dataset({'mid': mid, 'low': mid*p['lower'], 'high': mid*p['upper']})
+
+
+def aggregate_eez(eez_ids, fields, catch=None):
+    """Lazy catchtools.aggregate_eez: per-EEZ sums of fields (..., lat, lon)
+    and, with catch, catch totals and catch-weighted means, along a new eez
+    dim (labels, with raster IDs as the eez_id coordinate). Returns a Dataset."""
+    ids, member, _ = ct.eez_membership(np.asarray(eez_ids))
+    labels = [ct.eezindex_to_label[i] for i in ids]
+
+    def reduce(block):
+        flat = np.nan_to_num(block).reshape(-1, member.shape[0])
+        return np.asarray(flat @ member).reshape(block.shape[:-2] + (len(ids),))
+
+    def eez_sum(x):
+        out = xr.apply_ufunc(reduce, _whole_planes(x), input_core_dims=[list(spatial_dims)],
+                             output_core_dims=[['eez']], dask='parallelized',
+                             output_dtypes=[float],
+                             dask_gufunc_kwargs={'output_sizes': {'eez': len(ids)}})
+        return out.assign_coords(eez=labels, eez_id=('eez', ids))
+
+    out = xr.Dataset({'sum': eez_sum(fields)})
+    if catch is not None:
+        if 'region' in catch.dims and 'region' not in fields.dims:
+            catch = catch.sum('region')
+        total = eez_sum(catch)
+        out['catch'] = total
+        out['mean'] = eez_sum(fields*catch)/total.where(total > 0)
+    return out
@@ -1,14 +1,24 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
 from matplotlib import cm
-import matplotlib
 from copy import copy
 from matplotlib.colors import Normalize
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import numpy as np
 from cartopy import feature as cfeature
 from cartopy.io import shapereader
+from cartopy.mpl.patch import geos_to_path
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.colorbar as mcolorbar
+import matplotlib.image as mimage
 from .country_lookup import country_reference
+import hgprofile
 from shapely.geometry import MultiPolygon
 
 def plotmap(lons,
@@ -69,7 +79,7 @@ def plotmap(lons,
         fig = plt.figure(figsize=(12, 8))
         ax = plt.axes(projection=proj)  # ccrs.PlateCarree())
     ourcmap = kwargs.get('cmap', 'jet')
-    thecmap = copy(matplotlib.cm.get_cmap(ourcmap))
+    thecmap = copy(plt.get_cmap(ourcmap))
     thecmap.set_bad(color='w', alpha=0.)
     if gridlines:
         gridedge = 'k'
@@ -218,7 +228,7 @@ def make_map(projection="Robinson",
     vvmax = kwargs.get('vmax', vvmax)
 
     ourcmap = kwargs.get('cmap', 'jet')
-    thecmap = copy(matplotlib.cm.get_cmap(ourcmap))
+    thecmap = copy(plt.get_cmap(ourcmap))
     thecmap.set_bad(color='w', alpha=0.)
 
 
@@ -285,7 +295,13 @@ def make_map_base(projection="Robinson",
     return ax
 
 
-def add_gridded(ax, glons, glats, gridded, gridlines=False, **kwargs):
+def add_gridded(ax, glons, glats, gridded, gridlines=False, mode='pcolor', **kwargs):
+    """Draw gridded data on a map axes at zorder 12.
+    mode 'pcolor' draws one polygon per cell, 'mesh' a single quad mesh
+    (pcolormesh) and 'raster' a single image resampled to the axes'
+    projection (see raster_index; kwargs resolution=(nx, ny) sets its size)."""
+    if hasattr(gridded, 'todense'):  # e.g. catchtools.SparseGrid
+        gridded = np.asarray(gridded.todense())
     vmax = kwargs.get('vmax', np.max(gridded))
     vmin = kwargs.get('vmin', np.min(gridded))
     thecmap = kwargs.get('cmap', 'jet')
@@ -295,7 +311,11 @@ def add_gridded(ax, glons, glats, gridded, gridlines=False, **kwargs):
     else:
         gridedge = None
 
-    c = ax.pcolor(glons,
+    if mode == 'raster':
+        return _add_raster(ax, glons, glats, gridded, vmin, vmax, thecmap,
+                           kwargs.get('resolution', None))
+    draw = ax.pcolormesh if mode == 'mesh' else ax.pcolor
+    c = draw(glons,
                         glats,
                         gridded,
                         vmax=vmax,
@@ -310,6 +330,82 @@ def add_gridded(ax, glons, glats, gridded, gridlines=False, **kwargs):
        
     return c
 
+
+_raster_indices = {}
+
+
+def _cell_edges(coords, n):
+    """Cell edges from n centres or n+1 edges (as pcolor shading='auto')."""
+    coords = np.asarray(coords, dtype=float)
+    if len(coords) == n + 1:
+        return coords
+    mid = 0.5*(coords[1:] + coords[:-1])
+    return np.concatenate(([2*coords[0] - mid[0]], mid, [2*coords[-1] - mid[-1]]))
+
+
+def _edge_index(edges, x):
+    """Index of the cell containing each x, -1 outside the edges."""
+    flip = edges[0] > edges[-1]
+    e = edges[::-1] if flip else edges
+    i = np.searchsorted(e, x, side='right') - 1
+    i[~((x >= e[0]) & (x < e[-1]))] = -1
+    if flip:
+        i = np.where(i >= 0, len(edges) - 2 - i, -1)
+    return i
+
+
+def raster_index(lon_edges, lat_edges, projection, extent, shape):
+    """Flat source-cell index of every pixel of an image of shape (ny, nx)
+    covering extent (x0, x1, y0, y1) in projection; -1 where the pixel lies
+    outside the grid or the projection's domain. Longitudes wrap around.
+    Cached per grid, projection, extent and shape."""
+    lon_edges = np.asarray(lon_edges, dtype=float)
+    lat_edges = np.asarray(lat_edges, dtype=float)
+    key = (lon_edges.tobytes(), lat_edges.tobytes(), projection,
+           tuple(extent), tuple(shape))
+    if key in _raster_indices:
+        return _raster_indices[key]
+    ny, nx = shape
+    x0, x1, y0, y1 = extent
+    xs = x0 + (np.arange(nx) + 0.5)*(x1 - x0)/nx
+    ys = y0 + (np.arange(ny) + 0.5)*(y1 - y0)/ny
+    xx, yy = np.meshgrid(xs, ys)
+    lonlat = ccrs.PlateCarree().transform_points(projection, xx, yy)
+    lon, lat = lonlat[..., 0].ravel(), lonlat[..., 1].ravel()
+    valid = np.isfinite(lon) & np.isfinite(lat)
+    lon = np.where(valid, lon, 0.)
+    lat = np.where(valid, lat, np.nan)
+    west = min(lon_edges[0], lon_edges[-1])
+    lon = west + np.mod(lon - west, 360.)
+    ilon = _edge_index(lon_edges, lon)
+    ilat = _edge_index(lat_edges, lat)
+    index = np.where(valid & (ilon >= 0) & (ilat >= 0),
+                     ilat*(len(lon_edges) - 1) + ilon, -1).astype(np.int32).reshape(shape)
+    _raster_indices[key] = index
+    return index
+
+
+def _add_raster(ax, glons, glats, gridded, vmin, vmax, cmap, resolution=None):
+    glons, glats = np.asarray(glons), np.asarray(glats)
+    if glons.ndim == 2:
+        glons, glats = glons[0, :], glats[:, 0]
+    ny, nx = np.shape(gridded)
+    lon_edges, lat_edges = _cell_edges(glons, nx), _cell_edges(glats, ny)
+    if resolution is None:  # about one pixel per screen pixel
+        bbox = ax.get_window_extent()
+        resolution = (int(bbox.width), int(bbox.height))
+    extent = ax.get_xlim() + ax.get_ylim()
+    index = raster_index(lon_edges, lat_edges, ax.projection, extent,
+                         (resolution[1], resolution[0]))
+    values = np.ma.masked_invalid(np.asarray(gridded, dtype=float).ravel())
+    image = np.ma.masked_array(values.filled(0)[index], mask=(index < 0) | values.mask[index])
+    c = ax.imshow(image, origin='lower', extent=extent, transform=ax.projection,
+                  cmap=cmap, vmin=vmin, vmax=vmax, interpolation='nearest',
+                  zorder=12)
+    ax.set_xlim(extent[:2])
+    ax.set_ylim(extent[2:])
+    return c
+
 def add_contourf(ax, glons, glats, gridded, gridlines=None, **kwargs):
     levels = kwargs.get('levels', None)
     if levels is None:
@@ -319,7 +415,7 @@ def add_contourf(ax, glons, glats, gridded, gridlines=None, **kwargs):
         levels = np.linspace(vmin, vmax, N) 
 
     cmapname = kwargs.get('cmap', 'jet')
-    thecmap = cm.get_cmap(cmapname, len(levels))
+    thecmap = plt.get_cmap(cmapname, len(levels))
     # colors = [thecmap(x) for x in np.linspace(0.,1.0,len(levels))]
 
     if gridlines:
@@ -432,56 +528,209 @@ def add_colorbar(ax, c, logcolor=False, ticks=None, ticklabels=None, orientation
     return cbar
 
 
+class MapTemplate:
+    """Base map drawn once and reused to render many data layers to files.
+    The base layers below the data (zorder <= data_zorder, e.g. ocean) and
+    above it (land, lakes, borders, coastlines) are rasterized once; each
+    output only draws its add_gridded/add_contourf layer, title and colorbar
+    and is composited between the two cached rasters."""
+
+    def __init__(self, colorbar='horizontal', data_zorder=12, dpi=100, ratio=1.0,
+                 **kwargs):
+        self.ax = make_map_base(**kwargs)
+        self.fig = self.ax.figure
+        self.fig.set_dpi(dpi)
+        FigureCanvasAgg(self.fig)
+        self.cax = None
+        if colorbar:
+            frc = 0.056 if colorbar == 'horizontal' else 0.02
+            self.cax, _ = mcolorbar.make_axes(self.ax, orientation=colorbar,
+                                              fraction=frc * ratio, pad=0.01)
+        self.orientation = colorbar
+        self.data_zorder = data_zorder
+        self._base = list(self.ax.get_children())
+        self._visible = {a: a.get_visible() for a in self._base}
+        self._patches = [self.fig.patch, self.ax.patch]
+        self._under = self._render(lambda a: a.get_zorder() <= data_zorder, True)
+        self._over = self._render(lambda a: a.get_zorder() > data_zorder, False)
+
+    def _render(self, show, patches, data=False):
+        for a in self._base:
+            a.set_visible(self._visible[a] and show(a))
+        for p in self._patches:
+            p.set_visible(patches)
+        if self.cax is not None:
+            self.cax.set_visible(data)
+        self.fig.canvas.draw()
+        return np.asarray(self.fig.canvas.buffer_rgba()).copy()
+
+    def render(self, fname, glons, glats, gridded, kind='gridded', title='',
+               colorbar_kwargs=None, **kwargs):
+        """Draw one data layer on the cached base map and save it to fname.
+        kwargs go to add_gridded (kind='gridded') or add_contourf
+        ('contourf'), colorbar_kwargs to add_colorbar. Returns the RGBA image."""
+        before = set(self.ax.get_children())
+        add = add_contourf if kind == 'contourf' else add_gridded
+        c = None
+        try:
+            c = add(self.ax, glons, glats, gridded, **kwargs)
+            if self.cax is not None:
+                add_colorbar(self.ax, c, cax=self.cax, orientation=self.orientation,
+                             **(colorbar_kwargs or {}))
+            self.ax.set_title(title, fontsize=15)
+            layer = self._render(lambda a: a not in self._visible or a is self.ax.title,
+                                 False, data=True)
+        finally:
+            # the data artist goes first: removing it may take others with it
+            # (e.g. cartopy's GeoQuadMesh and its wrapped collection)
+            if c is not None and c in self.ax.get_children():
+                c.remove()
+            for a in set(self.ax.get_children()) - before:
+                if a not in self._visible and a in self.ax.get_children():
+                    a.remove()
+            self.ax.set_title('')
+            if self.cax is not None:
+                self.cax.clear()
+        image = _composite(self._over, _composite(layer, self._under))
+        if fname is not None:
+            mimage.imsave(fname, image)
+        return image
+
+
+def _composite(top, bottom):
+    """Alpha-composite two RGBA uint8 images (top over bottom)."""
+    top, bottom = top.astype(np.float32), bottom.astype(np.float32)
+    ta = top[..., 3:]/255
+    ba = bottom[..., 3:]*(1 - ta)/255
+    alpha = ta + ba
+    rgb = top[..., :3]*ta + bottom[..., :3]*ba
+    rgb = np.divide(rgb, alpha, out=np.zeros_like(rgb), where=alpha > 0)
+    return np.concatenate((rgb, alpha*255.), axis=-1).round().astype(np.uint8)
+
+
+_worker_template = None
+
+
+def _init_template(template_kwargs):
+    global _worker_template
+    _worker_template = MapTemplate(**template_kwargs)
+
+
+def _render_job(job):
+    _worker_template.render(**job)
+    return job['fname']
+
+
+def render_batch(jobs, processes=None, **template_kwargs):
+    """Render many maps that share one base map (see MapTemplate).
+    jobs is a list of dicts of MapTemplate.render arguments (fname, glons,
+    glats, gridded, ...). With processes > 1 the jobs are spread over a
+    process pool and each worker builds its own template once.
+    Returns the list of written file names."""
+    if not processes or processes == 1:
+        _init_template(template_kwargs)
+        return [_render_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_template,
+                             initargs=(template_kwargs,)) as pool:
+        chunksize = max(1, len(jobs) // (4*processes))
+        return list(pool.map(_render_job, jobs, chunksize=chunksize))
+
+
 def add_features(ax, fname):
     shape_feature = cfeature.ShapelyFeature(shapereader.Reader(fname).geometries(),
                                             ccrs.PlateCarree(), facecolor='k')
     ax.add_feature(shape_feature)
 
 
-def add_countries(ax, countries, data, edgecolor='none',
+# Natural Earth admin-0 countries shapefile used by add_countries
+countries_shapefile = os.environ.get(
+    'NE_COUNTRIES_SHAPEFILE',
+    '/home/thackray/Dropbox/ne_countries/ne_110m_admin_0_countries')
+_country_index = {}
+_country_paths = {}
+
+
+def set_countries_shapefile(fname):
+    """Point add_countries at another countries shapefile and drop cached geometries."""
+    global countries_shapefile
+    countries_shapefile = fname
+    _country_index.clear()
+    _country_paths.clear()
+
+
+def country_geometries(fname=None):
+    """Name -> geometry index of the countries shapefile, loaded once per file.
+    Names in country_lookup.country_reference resolve to their Natural Earth
+    geometry (or None if deliberately unmapped), and French Guiana is split
+    from France."""
+    fname = countries_shapefile if fname is None else fname
+    if fname not in _country_index:
+        geoms = {r.attributes['NAME']: r.geometry
+                 for r in shapereader.Reader(fname).records()}
+        if 'France' in geoms:
+            polygons = list(getattr(geoms['France'], 'geoms', [geoms['France']]))
+            geoms['French Guiana'] = MultiPolygon(polygons[0:1])
+            geoms['France'] = MultiPolygon(polygons[1:])
+        index = dict(geoms)
+        for name, ne_name in country_reference.items():
+            if ne_name is None:
+                index[name] = None
+            elif ne_name in geoms:
+                index[name] = geoms[ne_name]
+        _country_index[fname] = index
+    return _country_index[fname]
+
+
+def _country_path(name, projection, fname):
+    """Country geometry as one compound matplotlib path in projection coordinates."""
+    key = (fname, projection)
+    cache = _country_paths.setdefault(key, {})
+    if name not in cache:
+        geo = country_geometries(fname)[name]
+        projected = projection.project_geometry(geo, ccrs.PlateCarree())
+        paths = geos_to_path(projected)
+        cache[name] = Path.make_compound_path(*paths) if paths else None
+    return cache[name]
+
+
+def add_countries(ax, countries, data, edgecolor='none', fname=None,
                   **kwargs):
+    """Fill countries with data colors as one batched collection on ax."""
     vmax = kwargs.get('vmax', np.max(data))
     vmin = kwargs.get('vmin', np.min(data))
     thecmap = kwargs.get('cmap', 'jet')
     color_mappable = cm.ScalarMappable(
         Normalize(vmin=vmin, vmax=vmax), cmap=thecmap)
 
-    s = shapereader.Reader(
-        '/home/thackray/Dropbox/ne_countries/ne_110m_admin_0_countries')
-    map_map = {}
-    for r in s.records():
-        geo = r.geometry
-        try:
-            geo[0]
-            map_map[r.attributes['NAME']] = geo
-        except TypeError:
-            map_map[r.attributes['NAME']] = [geo]
-
+    fname = countries_shapefile if fname is None else fname
+    index = country_geometries(fname)
+    patches, values = [], []
     for country, datum in zip(countries, data):
-        ne_country = country_reference.get(country, country)
-        if ne_country is None:
-            pass
-        else:
-            try:
-                
-                if ne_country == 'France':
-                    polygons = list(map_map[ne_country])
-                    geo = MultiPolygon(polygons[1:])
-                elif ne_country == 'French Guiana':
-                    polygons = list(map_map['France'])
-                    geo = MultiPolygon(polygons[0:1])
-                else:
-                    geo = map_map[ne_country]
-                shape_feature = cfeature.ShapelyFeature(geo,
-                                                        ccrs.PlateCarree(),
-                                                        edgecolor=edgecolor,
-                                                        facecolor=color_mappable.to_rgba(datum))
-                ax.add_feature(shape_feature, zorder=100)
-            except KeyError:
-                print(ne_country)
+        if country not in index:
+            print(country_reference.get(country, country))
+            continue
+        if index[country] is None:
+            continue
+        path = _country_path(country, ax.projection, fname)
+        if path is not None:
+            patches.append(PathPatch(path))
+            values.append(datum)
+
+    collection = PatchCollection(patches, edgecolor=edgecolor,
+                                 facecolor=color_mappable.to_rgba(np.asarray(values)),
+                                 transform=ax.transData, zorder=100)
+    ax.add_collection(collection, autolim=False)
     return color_mappable
 
 
+# Drawing calls recorded by hgprofile while profiling is enabled
+profiled_calls = ['plotmap', 'make_map_base', 'add_gridded', 'add_contourf', 'add_points',
+                  'add_colorbar', 'add_features', 'country_geometries', 'add_countries',
+                  'raster_index', 'render_batch']
+hgprofile.instrument_module(globals(), profiled_calls, 'plottools.maps')
+MapTemplate.render = hgprofile.instrument(MapTemplate.render, 'plottools.maps')
+
+
 if __name__ == '__main__':
     lats = np.linspace(-89.5, 89.5, 180)
     lons = np.linspace(-179.5, 179.5, 360)
@@ -0,0 +1,283 @@
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+
+import catchtools as ct
+
+# Inputs attached from shared memory in each worker process
+_shared_inputs = {}
+_shared_blocks = []
+
+
+def share_arrays(inputs):
+    """Copy arrays (or catchtools.SparseGrid) into shared memory blocks.
+    Returns (blocks, specs); specs describes the blocks for attach_arrays and
+    the caller must close and unlink the blocks when done."""
+    blocks, specs = [], {}
+
+    def share(arr):
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        blocks.append(shm)
+        return (shm.name, arr.shape, arr.dtype.str)
+
+    for key, val in inputs.items():
+        if isinstance(val, ct.SparseGrid):
+            m = val.matrix
+            specs[key] = ('sparse', val.shape,
+                          [share(m.data), share(m.indices), share(m.indptr)])
+        else:
+            specs[key] = ('dense', None, [share(val)])
+    return blocks, specs
+
+
+def attach_arrays(specs):
+    """Read-only views of arrays shared by share_arrays (no copies)."""
+    arrays = {}
+    for key, (kind, shape, parts) in specs.items():
+        views = []
+        for name, pshape, dtype in parts:
+            shm = shared_memory.SharedMemory(name=name)
+            _shared_blocks.append(shm)
+            view = np.ndarray(pshape, dtype=dtype, buffer=shm.buf)
+            view.flags.writeable = False
+            views.append(view)
+        if kind == 'sparse':
+            nrows = int(np.prod(shape[:-2], dtype=np.int64))
+            matrix = sps.csr_matrix(tuple(views), shape=(nrows, shape[-2]*shape[-1]))
+            arrays[key] = ct.SparseGrid(matrix, shape)
+        else:
+            arrays[key] = views[0]
+    return arrays
+
+
+def _init_worker(specs):
+    _shared_inputs.update(attach_arrays(specs))
+
+
+def _run_scenario(scenario, config, scenario_func, outdir):
+    eez_table, subsistence_table = scenario_func(_shared_inputs, **config)
+    paths = (os.path.join(outdir, f'eez_country_table_{scenario}.csv'),
+             os.path.join(outdir, f'subsistence_table_{scenario}.csv'))
+    eez_table.to_csv(paths[0], index=False)
+    subsistence_table.to_csv(paths[1], index=False)
+    return paths
+
+
+def run_scenarios(scenarios, inputs, scenario_func, outdir='scenario_data',
+                  processes=None):
+    """Run independent uncertainty scenarios in a process pool.
+    scenarios maps scenario name -> dict of keyword arguments for
+    scenario_func(inputs, **config), which must be a picklable (module-level)
+    function returning the (eez_table, subsistence_table) DataFrames. The
+    large read-only inputs (e.g. catch cube, seawater Hg fields, cell-id grid)
+    are placed in shared memory once and attached by every worker.
+    Tables are written as eez_country_table_{scenario}.csv and
+    subsistence_table_{scenario}.csv in outdir, as read by the notebook.
+    Returns {scenario: (eez_path, subsistence_path)}."""
+    os.makedirs(outdir, exist_ok=True)
+    blocks, specs = share_arrays(inputs)
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(specs,)) as pool:
+            futures = {scenario: pool.submit(_run_scenario, scenario, config,
+                                             scenario_func, outdir)
+                       for scenario, config in scenarios.items()}
+            return {scenario: f.result() for scenario, f in futures.items()}
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+# Columnar storage of scenario_data tables
+columnar_version = 2  # bumped when the on-disk layout changes
+scenario_tables = {'categories': '{scenario}_scenario_categories',
+                   'eez': 'eez_country_table_{scenario}',
+                   'subsistence': 'subsistence_table_{scenario}'}
+
+
+def convert_table(csvfile, coldir=None, **kwargs):
+    """Convert a CSV table to one .npy file per column (memory-mappable).
+    Text is stored as fixed-width unicode; object columns holding bools or
+    numbers (as pandas reads them when values are missing) keep a bool or
+    float dtype. Missing values of such columns go to a separate mask.
+    Column names and order are kept in columns.json. Returns coldir."""
+    coldir = os.path.splitext(csvfile)[0] + '.cols' if coldir is None else coldir
+    df = pd.read_csv(csvfile, **kwargs)
+    os.makedirs(coldir, exist_ok=True)
+    manifest = []
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        entry = {'name': col, 'file': f'c{i:03d}.npy'}
+        if values.dtype.kind in 'biufcmM':
+            arr = values.to_numpy()
+        else:
+            # object columns: bools/numbers with missing values keep their type
+            missing = values.isna().to_numpy()
+            kind = pd.api.types.infer_dtype(values, skipna=True)
+            if kind == 'boolean':
+                arr = values.where(~missing, False).to_numpy().astype(bool)
+            elif kind in ('integer', 'floating', 'mixed-integer-float', 'decimal'):
+                arr = values.astype(float).to_numpy()
+            else:
+                arr = values.astype(str).to_numpy().astype(str)
+                arr[missing] = ''
+            if missing.any():
+                entry['missing'] = f'c{i:03d}_na.npy'
+                np.save(os.path.join(coldir, entry['missing']), missing)
+        np.save(os.path.join(coldir, entry['file']), arr)
+        manifest.append(entry)
+    with open(os.path.join(coldir, 'columns.json'), 'w') as f:
+        json.dump({'source': os.path.basename(csvfile), 'version': columnar_version,
+                   'columns': manifest}, f, indent=1)
+    return coldir
+
+
+def is_converted(csvfile, coldir=None):
+    """True if coldir holds a current columnar copy of csvfile (written in
+    this format version, and not older than the CSV)."""
+    coldir = os.path.splitext(csvfile)[0] + '.cols' if coldir is None else coldir
+    manifest = os.path.join(coldir, 'columns.json')
+    if not os.path.exists(manifest):
+        return False
+    if os.path.exists(csvfile) and os.path.getmtime(manifest) < os.path.getmtime(csvfile):
+        return False
+    with open(manifest) as f:
+        return json.load(f).get('version') == columnar_version
+
+
+def convert_scenario_data(datadir='scenario_data', force=False):
+    """One-time conversion of all CSV tables in datadir to columnar form.
+    Tables whose columnar copy is newer than the CSV are skipped."""
+    converted = []
+    for csvfile in sorted(glob.glob(os.path.join(datadir, '*.csv'))):
+        if not force and is_converted(csvfile):
+            continue
+        converted.append(convert_table(csvfile))
+    return converted
+
+
+class ColumnTable:
+    """Lazily memory-mapped columns of a table written by convert_table.
+    Columns are opened on first access, so only the ones used are read.
+    Indexing by column name returns a read-only array; to_frame builds a
+    DataFrame of selected columns."""
+
+    def __init__(self, coldir):
+        self.coldir = coldir
+        with open(os.path.join(coldir, 'columns.json')) as f:
+            self._manifest = {c['name']: c for c in json.load(f)['columns']}
+        self._cache = {}
+
+    @property
+    def columns(self):
+        return list(self._manifest)
+
+    def __contains__(self, col):
+        return col in self._manifest
+
+    def __len__(self):
+        return len(self[self.columns[0]]) if self._manifest else 0
+
+    def __getitem__(self, col):
+        if col not in self._cache:
+            entry = self._manifest[col]
+            arr = np.load(os.path.join(self.coldir, entry['file']), mmap_mode='r')
+            if 'missing' in entry:
+                missing = np.load(os.path.join(self.coldir, entry['missing']))
+                arr = np.where(missing, None, arr.astype(object))
+            self._cache[col] = arr
+        return self._cache[col]
+
+    def to_frame(self, columns=None):
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({col: self[col] for col in columns})
+
+
+def load_scenario_table(kind, scenario, datadir='scenario_data'):
+    """ColumnTable for a scenario table ('categories', 'eez' or 'subsistence'),
+    (re)converting the CSV when it is newer than its columnar copy."""
+    stem = os.path.join(datadir, scenario_tables[kind].format(scenario=scenario))
+    if not is_converted(stem + '.csv'):
+        convert_table(stem + '.csv')
+    return ColumnTable(stem + '.cols')
+
+
+# Summaries across scenarios
+def _stack_tables(kind, scenarios, columns, datadir):
+    """Concatenate the given columns of a table kind over scenarios, keyed by
+    an ordered categorical scenario column. Scenarios without the table are skipped."""
+    frames = {}
+    for scenario in scenarios:
+        stem = os.path.join(datadir, scenario_tables[kind].format(scenario=scenario))
+        if os.path.exists(stem + '.csv') or os.path.exists(stem + '.cols'):
+            frames[scenario] = load_scenario_table(kind, scenario, datadir).to_frame(columns)
+    if frames:
+        stacked = pd.concat(frames, names=['scenario', None]).reset_index(level=0)
+    else:
+        stacked = pd.DataFrame(columns=['scenario'] + list(columns or []))
+    stacked['scenario'] = pd.Categorical(stacked['scenario'], categories=list(scenarios))
+    return stacked.reset_index(drop=True)
+
+
+def scenario_category_totals(scenarios, datadir='scenario_data', species=' species'):
+    """Per-species column sums of the category tables for all scenarios,
+    indexed by (scenario, species)."""
+    stacked = _stack_tables('categories', scenarios, None, datadir)
+    return stacked.groupby(['scenario', species], observed=True).sum()
+
+
+def _as_flag(values):
+    """Boolean Series from bools, 0/1 numbers or 'True'/'False'/'1'/'0' text
+    (as read from CSV or stacked from mixed tables); missing is False."""
+    if pd.api.types.is_bool_dtype(values):
+        return values.fillna(False).astype(bool)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.fillna(0) != 0
+    text = values.astype(str).str.strip().str.lower()
+    number = pd.to_numeric(text.where(text != 'true', '1'), errors='coerce')
+    return number.fillna(0) != 0
+
+
+def summarize_scenarios(scenarios, datadir='scenario_data'):
+    """Reported EEZ and subsistence metrics for all scenarios, one row each.
+    Percentages of EEZ rows with Hg:Se < 1 (overall and among tropical ones)
+    and with Hg:Se > 0.2, the highest avg. MeHg concentration, and the number
+    of countries with mean reference consumption below 170 g/day. Each table
+    is stacked once and reduced with a single groupby; scenarios missing a
+    table get NaN."""
+    eez = _stack_tables('eez', scenarios, ['Hg:Se', 'tropical'], datadir)
+    hgse = eez['Hg:Se'].astype(float)
+    tropical = _as_flag(eez['tropical'])
+    eez = eez.assign(lt1=hgse < 1, trop=tropical, trop_lt1=(hgse < 1) & tropical,
+                     gt02=hgse > 0.2)
+    e = eez.groupby('scenario', observed=False).agg(
+        n=('lt1', 'size'), lt1=('lt1', 'sum'), trop=('trop', 'sum'),
+        trop_lt1=('trop_lt1', 'sum'), gt02=('gt02', 'sum'))
+
+    sub = _stack_tables('subsistence', scenarios,
+                        ['avg. MeHg concentration', 'mean reference consumption (g/day)'],
+                        datadir)
+    sub = sub.assign(below170=sub['mean reference consumption (g/day)'].astype(float) < 170.0)
+    s = sub.groupby('scenario', observed=False).agg(
+        n=('below170', 'size'), maxmehg=('avg. MeHg concentration', 'max'),
+        below170=('below170', 'sum'))
+    e = e.where(e['n'] > 0)
+    s = s.where(s['n'] > 0)
+
+    summary = pd.DataFrame({
+        '% Hg:Se < 1': 100*e['lt1']/e['n'],
+        '% tropical Hg:Se < 1': 100*e['trop_lt1']/e['trop'],
+        '% Hg:Se > 0.2': 100*e['gt02']/e['n'],
+        'max avg. MeHg concentration': s['maxmehg'],
+        'n reference consumption < 170 g/day': s['below170'],
+    }, index=pd.Index(list(scenarios), name='scenario'))
+    return summary